@@ -28,6 +28,7 @@ from . import resources
 
 # Import the code for the DockWidget
 from .aerogen_dockwidget import AeroGenDockWidget
+from .provider import register_provider, unregister_provider
 import os.path
 
 
@@ -169,6 +170,9 @@ class AeroGen:
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
 
+        # layers served from survey arrays without intermediate files
+        register_provider()
+
         icon_path = ':/plugins/AeroGen/icon.png'
         self.add_action(
             icon_path,
@@ -206,6 +210,8 @@ class AeroGen:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        unregister_provider()
+
     #--------------------------------------------------------------------------
 
     def run(self):
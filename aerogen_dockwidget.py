@@ -22,19 +22,34 @@
 """
 
 import os
-import shutil
+from functools import partial
 
 from qgis.PyQt import QtGui, uic
-from qgis.PyQt.QtCore import pyqtSignal, QSettings
+from qgis.PyQt.QtCore import pyqtSignal, QSettings, QVariant, QStandardPaths
 from qgis.PyQt.QtWidgets import QDockWidget, QFileDialog
 
 from qgis.gui import QgsMessageBar
-from qgis.core import QgsProject, QgsCoordinateReferenceSystem, QgsVectorFileWriter, QgsWkbTypes, Qgis
+from qgis.core import QgsProject, QgsVectorFileWriter, QgsWkbTypes, Qgis, \
+    QgsField, QgsFields, QgsVectorDataProvider, QgsVectorLayer
 from qgis.utils import iface
 
-from .reader import AerogenReader, AerogenReaderError, AerogenReaderCRS
+from .reader import AerogenReader, AerogenReaderError, AerogenReaderCRS, main_xyz_file
 from .exceptions import AerogenError
-from .aerogen_layer import AerogenLayer
+from .aerogen_layer import AerogenLayer, FORMATS
+from .mosaic import AerogenMosaic
+from .prefetch import AerogenPrefetcher
+from .archive import AerogenArchive
+from .watcher import AerogenWatcher
+from .layer_style import apply_style
+from .validator import AerogenValidator
+from .manifest import AerogenManifest
+from .mbtiles import export_mbtiles
+from .waypoints import AerogenWaypoints
+from .samples import AerogenSampler
+from .drape import AerogenDem, AerogenDrape
+from . import crs_registry
+from . import provider
+from .tracking import AerogenLineIndex, AerogenTrackReplay, read_nmea, read_gpx
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'aerogen_dockwidget_base.ui'))
@@ -59,18 +74,49 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
 
         # reader
         self._ar = None
+        self._prefetcher = None
+        # function used to open input files (prefetcher or archive)
+        self._opener = open
+        self._watcher = None
+        # loaded layer ids by product
+        self._layers = {}
+        # editable flight paths by layer id, created on the first edit
+        self._sessions = {}
+        self._outputDir = None
         self._rsCrs = None
-        self._destCrs = None
 
         self.browseButton.clicked.connect(self.OnBrowseInput)
+        self.archiveButton.clicked.connect(self.OnBrowseArchive)
         self.generateButton.clicked.connect(self.OnGenerate)
         self.outputButton.clicked.connect(self.OnBrowseOutput)
+        self.mosaicButton.clicked.connect(self.OnMosaic)
+        self.validateButton.clicked.connect(self.OnValidate)
+        self.replayButton.clicked.connect(self.OnReplay)
+        self.drapeButton.clicked.connect(self.OnDrape)
+        self.browseSurveyButton.clicked.connect(self.OnBrowseSurvey)
+        self.exportTilesButton.clicked.connect(self.OnExportTiles)
+        self.checkBoxWatch.toggled.connect(self.OnWatch)
+        self.checkBoxGenerateLines.toggled.connect(self.checkBoxXyz.setEnabled)
+        self.checkBoxClip.toggled.connect(self.spinBoxLead.setEnabled)
+        self.checkBoxWaypoints.toggled.connect(self.spinBoxWaypointSpacing.setEnabled)
+        self.checkBoxWaypoints.toggled.connect(self.spinBoxTurnRadius.setEnabled)
+        self.checkBoxSamples.toggled.connect(self.spinBoxSpeed.setEnabled)
+        self.checkBoxSamples.toggled.connect(self.lineEditRates.setEnabled)
+        self.comboBoxCrs.currentIndexChanged.connect(self._onCrsChanged)
+        self.checkBoxMeasure.toggled.connect(self._onMeasureToggled)
+        self.checkBoxAltitude.toggled.connect(self.spinBoxAltitude.setEnabled)
 
         # disable some widgets
         self.outputButton.setEnabled(False)
         self.generateButton.setEnabled(False)
+        self.validateButton.setEnabled(False)
+        self.replayButton.setEnabled(False)
+        self.drapeButton.setEnabled(False)
+        self.browseSurveyButton.setEnabled(False)
+        self.exportTilesButton.setEnabled(False)
         
     def closeEvent(self, event):
+        self.OnWatch(False)
         self.closingPlugin.emit()
         event.accept()
 
@@ -91,25 +137,78 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
             return
 
         directoryPath = os.path.normpath(directoryPath)
+        # fetch all input files at once
+        self._prefetcher = AerogenPrefetcher(directoryPath, self._cacheDir())
+        try:
+            self._prefetcher.fetch()
+        except (IOError, OSError) as e:
+            iface.messageBar().pushMessage(
+                self.tr("Error"),
+                "{}".format(e),
+                level=Qgis.Critical
+            )
+            return
+
+        self._opener = self._prefetcher.open
+
         filePath = os.path.join(directoryPath, self._getMainXyzFile(directoryPath))
+        self._loadInput(filePath, directoryPath, sender)
+
+    def OnBrowseArchive(self):
+        sender = 'AeroGen-{}-lastUserFilePath'.format(self.sender().objectName())
+        # load lastly used directory path
+        lastPath = self._settings.value(sender, '')
+
+        archivePath, __ = QFileDialog.getOpenFileName(
+            self, self.tr("Archive with XYZ files"), lastPath,
+            self.tr("Archives (*.zip *.tar *.tar.gz *.tgz *.tar.xz *.txz *.tar.bz2 *.tar.zst *.tzst "
+                    "*.xyz.gz *.xyz.xz *.xyz.zst)")
+        )
+        if not archivePath:
+            # action canceled
+            return
+
+        archivePath = os.path.normpath(archivePath)
+        try:
+            archive = AerogenArchive(archivePath)
+            main = archive.main_file()
+            if main is None:
+                raise AerogenError(self.tr("No main XYZ file found in {}").format(archivePath))
+        except (IOError, OSError, AerogenError) as e:
+            iface.messageBar().pushMessage(
+                self.tr("Error"),
+                "{}".format(e),
+                level=Qgis.Critical
+            )
+            return
+
+        # members are streamed from the archive, no prefetching nor watching
+        self._prefetcher = None
+        self._opener = archive.open
+        self.checkBoxWatch.setChecked(False)
+
+        self._loadInput(os.path.join(archivePath, main), os.path.dirname(archivePath), sender)
+
+    def _loadInput(self, filePath, outputDir, sender):
+        """Read main XYZ file and prepare widgets for generating outputs."""
         self.textInput.setText(filePath)
-        
+
         # remember directory path
         self._settings.setValue(sender, os.path.dirname(filePath))
 
-        # set 4326 crs for output files
-        self._destCrs = QgsCoordinateReferenceSystem(4326,
-                                                     QgsCoordinateReferenceSystem.EpsgCrsId)
-
         # set default output path
-        self.textOutput.setText(directoryPath)
+        self.textOutput.setText(outputDir)
 
         # read input file
         try:
-            self._ar = AerogenReader(filePath)
+            self._ar = AerogenReader(filePath, self._opener)
             crs = self._ar.crs()
             self.outputButton.setEnabled(True)
             self.generateButton.setEnabled(True)
+            self.validateButton.setEnabled(True)
+            self.replayButton.setEnabled(True)
+            self.drapeButton.setEnabled(True)
+            self.browseSurveyButton.setEnabled(True)
         except AerogenReaderError as e:
             iface.messageBar().pushMessage(
                 self.tr("Error"),
@@ -126,8 +225,12 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
             return
 
         # autodetect CRS by EPSG code
-        self._rsCrs = QgsCoordinateReferenceSystem(crs,
-                                                   QgsCoordinateReferenceSystem.EpsgCrsId)
+        self._rsCrs = crs_registry.crs(crs)
+
+        # watch newly selected directory
+        self._layers = {}
+        self._sessions = {}
+        self.OnWatch(self.checkBoxWatch.isChecked())
 
     def OnGenerate(self):
         if not self._ar:
@@ -135,41 +238,47 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
 
         output_dir = self.textOutput.toPlainText()
         try:
-            for name, fn in (('polygon', self._ar.area),
-                             ('survey_lines', self._ar.sl),
-                             ('tie_lines', self._ar.tl)):
-                # create a new Shapefile layer
-                output_file = os.path.join(output_dir, self._ar.basename() + '_{}.shp'.format(name))
-                if name == 'polygon':
-                    layer = AerogenLayer(output_file, fn(), self._rsCrs)
+            self._refreshInput()
+            self._generateLines(output_dir)
+            self._outputDir = output_dir
+            self._layers = {}
+            self._sessions = {}
+            layers = []
+            basename = self._ar.basename()
+            manifest = AerogenManifest(output_dir, self._opener)
+            settings = self._settingsManifest()
+            skipped = 0
+            for product in ('area', 'sl', 'tl'):
+                name, __, crs = self._product(product)
+                key = '{}_{}'.format(basename, name)
+                inputs = self._productInputs(product)
+                output_file = os.path.join(output_dir, key + FORMATS[settings['format']][0])
+                if manifest.up_to_date(key, inputs, settings):
+                    # inputs and settings not changed since last run
+                    layer = QgsVectorLayer(output_file, key, "ogr")
+                    layer.loadNamedStyle(os.path.join(output_dir, key + '.qml'))
+                    skipped += 1
                 else:
-                    layer = AerogenLayer(output_file, fn(), self._destCrs)
-                style_input_file = self.stylePath(name)
-                # apply style for layer
-                layer.loadNamedStyle(style_input_file)
-                # also copy the style into output directory with name of the output layer
-                style_output_file = os.path.join(output_dir, self._ar.basename() + '_{}.qml'.format(name))
-                shutil.copyfile(style_input_file, style_output_file)
-                # add map layer to the canvas
-                QgsProject.instance().addMapLayer(layer)
-                if self.checkBoxGpx.isChecked():
-                    if layer.geometryType() == QgsWkbTypes.LineGeometry:
-                        # generate gpx output also for tie and survey lines
-                        output_file_gpx = os.path.join(output_dir, self._ar.basename() + '_{}.gpx'.format(name))
-                        QgsVectorFileWriter.writeAsVectorFormat(layer = layer,
-                                                                fileName = output_file_gpx,
-                                                                driverName = "GPX",
-                                                                fileEncoding = "UTF-8",
-                                                                destCRS = QgsCoordinateReferenceSystem(4326),
-                                                                layerOptions = ["FORCE_GPX_TRACK = YES"],
-                                                                skipAttributeCreation = True
-                        )
+                    geometries, fields, attributes = self._productFeatures(product)
+                    layer = self._writeLayer(output_dir, basename, name, geometries, crs,
+                                             fields, attributes)
+                    self._writeWaypoints(output_dir, basename, name, product)
+                    self._writeSamples(output_dir, basename, name, product)
+                    manifest.update(key, inputs, settings, AerogenManifest.outputs(output_dir, key))
+                layers.append(layer)
+                self._layers[product] = layer.id()
+                self._connectEdits(layer, product)
+            manifest.save()
+            # add map layers to the canvas
+            self._addLayers(layers, self._ar.basename())
+            self.exportTilesButton.setEnabled(True)
 
             iface.messageBar().pushMessage(
                 self.tr("Success"),
-                self.tr("Output layers saved to {}").format(output_dir),
+                self.tr("Output layers saved to {} ({} up to date)").format(output_dir, skipped),
                 level=Qgis.Success
             )
+            self._reportClipping()
 
         except (AerogenReaderError, AerogenError) as e:
             iface.messageBar().pushMessage(self.tr("Error"),
@@ -177,6 +286,599 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
                                            level=Qgis.Critical
             )
 
+    def OnBrowseSurvey(self):
+        """Load survey layers served from reader arrays, no files are written.
+
+        Layers are not restored when saved project is opened again.
+        """
+        if not self._ar:
+            return
+
+        try:
+            self._ar.set_generate_lines(self.checkBoxGenerateLines.isChecked())
+            self._ar.set_clip_lines(self._clipLead())
+            basename = self._ar.basename()
+            crs = self._outputCrs(self._rsCrs)
+            layers = []
+            for product in ('area', 'sl', 'tl'):
+                name = self._product(product)[0]
+                if product == 'area':
+                    dataset = provider.area_dataset(self._ar, crs)
+                else:
+                    dataset = provider.lines_dataset(self._ar, product, crs)
+                uri = '{}_{}'.format(basename, name)
+                provider.register(uri, dataset)
+                layer = QgsVectorLayer(uri, uri, provider.PROVIDER_KEY)
+                if not layer.isValid():
+                    raise AerogenError(self.tr("Unable to load {}").format(uri))
+                apply_style(layer, self.stylePath(name))
+                self._connectEdits(layer, product)
+                layers.append(layer)
+            self._addLayers(layers, basename)
+            iface.messageBar().pushMessage(
+                self.tr("Info"),
+                self.tr("Survey layers are kept in memory only, they are not restored from saved project"),
+                level=Qgis.Info
+            )
+            self._reportClipping()
+
+        except (AerogenReaderError, AerogenError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+
+    def _reportClipping(self):
+        """Show lines modified by clipping."""
+        modified = []
+        for type in ('sl', 'tl'):
+            for line_id, status, shift in self._ar.clip_report(type):
+                modified.append('{} ({}, {:.0f} m)'.format(line_id, status, shift))
+        if modified:
+            iface.messageBar().pushMessage(
+                self.tr("Info"),
+                self.tr("Lines modified by clipping: {}").format(', '.join(modified)),
+                level=Qgis.Info
+            )
+
+    def OnValidate(self):
+        if not self._ar:
+            return
+
+        try:
+            self._refreshInput()
+            validator = AerogenValidator(self.textInput.toPlainText(), self._opener)
+            report = validator.validate()
+        except (AerogenReaderError, AerogenReaderCRS, AerogenError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+            return
+
+        if not report:
+            iface.messageBar().pushMessage(
+                self.tr("Success"),
+                self.tr("Survey delivery is consistent"),
+                level=Qgis.Success
+            )
+            return
+
+        layer = validator.errors_layer(self._ar.basename() + '_validation_errors')
+        if layer.featureCount() > 0:
+            self._addLayers([layer], self._ar.basename())
+        iface.messageBar().pushMessage(
+            self.tr("Warning"),
+            self.tr("{} issues found: {}").format(
+                len(report), '; '.join(sorted(set(issue[2] for issue in report)))),
+            level=Qgis.Warning
+        )
+
+    def OnReplay(self):
+        if not self._ar:
+            return
+
+        sender = 'AeroGen-{}-lastUserTrackPath'.format(self.sender().objectName())
+        lastPath = self._settings.value(sender, '')
+        filePath, _ = QFileDialog.getOpenFileName(
+            self, self.tr("GPS log"), lastPath,
+            self.tr("GPS logs (*.nmea *.nma *.log *.txt *.gpx)")
+        )
+        if not filePath:
+            # action canceled
+            return
+        self._settings.setValue(sender, os.path.dirname(filePath))
+
+        try:
+            xy = self._ar.line_array('sl')
+            index = AerogenLineIndex(xy, self._ar.line_ids('sl', len(xy) // 2))
+            replay = AerogenTrackReplay(index)
+            reader = read_gpx if filePath.lower().endswith('.gpx') else read_nmea
+            xform = crs_registry.transform(self._wgsCrs(), self._rsCrs)
+            replay.replay(reader(filePath), xform)
+            output_file = os.path.join(self.textOutput.toPlainText(),
+                                       self._ar.basename() + '_coverage.csv')
+            replay.write_summary(output_file)
+        except (AerogenReaderError, AerogenReaderCRS, AerogenError, IOError, ValueError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+            return
+
+        summary = replay.summary()
+        coverage = sum(item['coverage'] for item in summary) / max(len(summary), 1)
+        iface.messageBar().pushMessage(
+            self.tr("Success"),
+            self.tr("Survey lines covered from {:.1f} %, summary saved to {}").format(
+                coverage * 100, output_file),
+            level=Qgis.Success
+        )
+
+    def OnDrape(self):
+        if not self._ar:
+            return
+
+        sender = 'AeroGen-{}-lastUserDemPath'.format(self.sender().objectName())
+        lastPath = self._settings.value(sender, '')
+        filePath, _ = QFileDialog.getOpenFileName(
+            self, self.tr("Digital elevation model"), lastPath,
+            self.tr("GeoTIFF (*.tif *.tiff);;All files (*)")
+        )
+        if not filePath:
+            # action canceled
+            return
+        self._settings.setValue(sender, os.path.dirname(filePath))
+
+        output_dir = self.textOutput.toPlainText()
+        basename = self._ar.basename()
+        crs = self._outputCrs(self._rsCrs)
+        try:
+            drape = AerogenDrape(AerogenDem(filePath), self.spinBoxClearance.value(),
+                                 self.spinBoxClimb.value() / 100, self.spinBoxDescent.value() / 100,
+                                 self.spinBoxDrapeSpacing.value())
+            fields = QgsFields()
+            fields.append(QgsField('line', QVariant.String))
+            layers = []
+            for product in ('sl', 'tl'):
+                name = self._product(product)[0]
+                xy = self._ar.line_array(product)
+                ids = self._ar.line_ids(product, len(xy) // 2)
+                profiles = drape.profiles(xy, self._rsCrs, ids)
+                AerogenDrape.write_csv(
+                    os.path.join(output_dir, basename + '_{}.drape.csv'.format(name)), profiles)
+                geometries = AerogenDrape.geometries(profiles, crs_registry.transform(self._rsCrs, crs))
+                attributes = [[str(line_id)] for line_id in ids]
+                layers.append(self._writeLayer(output_dir, basename, name + '_drape', geometries,
+                                               crs, fields, attributes, name))
+            self._addLayers(layers, basename)
+        except (AerogenReaderError, AerogenReaderCRS, AerogenError, IOError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+            return
+
+        iface.messageBar().pushMessage(
+            self.tr("Success"),
+            self.tr("Altitude profiles saved to {}").format(output_dir),
+            level=Qgis.Success
+        )
+
+    def OnExportTiles(self):
+        layers = [QgsProject.instance().mapLayer(layer_id) for layer_id in self._layers.values()]
+        layers = [layer for layer in layers if layer is not None]
+        if not layers:
+            iface.messageBar().pushMessage(self.tr("Info"),
+                                           self.tr("Generate layers first"),
+                                           level=Qgis.Info
+            )
+            return
+
+        output_file = os.path.join(self._outputDir, self._ar.basename() + '.mbtiles')
+        filePath, _ = QFileDialog.getSaveFileName(self, self.tr("Export MBTiles"), output_file,
+                                                  self.tr("MBTiles (*.mbtiles)"))
+        if not filePath:
+            # action canceled
+            return
+
+        try:
+            export_mbtiles(layers, filePath)
+        except AerogenError as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+            return
+
+        iface.messageBar().pushMessage(
+            self.tr("Success"),
+            self.tr("Vector tiles saved to {}").format(filePath),
+            level=Qgis.Success
+        )
+
+    def _product(self, product):
+        """Returns output name, function returning geometries and CRS of
+        the product, flight path is returned as single geometry (see
+        _productFeatures())."""
+        crs = self._outputCrs(self._rsCrs)
+        if product == 'area':
+            return 'polygon', partial(self._ar.area, crs), crs
+        name = 'survey_lines' if product == 'sl' else 'tie_lines'
+        if product == 'sl':
+            return name, partial(self._ar.sl, crs), crs
+        return name, partial(self._ar.tl, crs), crs
+
+    def _productFeatures(self, product):
+        """Returns geometries, fields and attributes of the product,
+        separate flight lines come with line numbers."""
+        name, fn, crs = self._product(product)
+        if product == 'area' or not self.checkBoxMeasure.isChecked():
+            return fn(), None, None
+        ids, geometries = self._ar.line_features(product, crs, self._altitude())
+        fields = QgsFields()
+        fields.append(QgsField('line', QVariant.String))
+        return geometries, fields, [[str(line_id)] for line_id in ids]
+
+    def _altitude(self):
+        """Returns planned altitude in header units or None."""
+        if not self.checkBoxAltitude.isChecked():
+            return None
+        return self.spinBoxAltitude.value()
+
+    def _onMeasureToggled(self, checked):
+        self.checkBoxAltitude.setEnabled(checked)
+        self.spinBoxAltitude.setEnabled(checked and self.checkBoxAltitude.isChecked())
+
+    def _outputCrs(self, utm):
+        """Returns CRS all products are written in.
+
+        :param utm: survey UTM zone CRS
+        """
+        index = self.comboBoxCrs.currentIndex()
+        if index == 1:
+            crs = QgsProject.instance().crs()
+        elif index == 2:
+            crs = self.crsSelector.crs()
+        else:
+            return utm
+
+        return crs if crs.isValid() else utm
+
+    def _onCrsChanged(self, index):
+        self.crsSelector.setEnabled(index == 2)
+
+    def _productInputs(self, product):
+        """Returns input files of the product."""
+        main_file = self.textInput.toPlainText()
+        if product == 'area' or self.checkBoxGenerateLines.isChecked():
+            return [main_file]
+        return [main_file,
+                os.path.join(self._ar.dirname(), '{}_{}.xyz'.format(self._ar.basename(), product))]
+
+    def _settingsManifest(self):
+        """Returns settings affecting generated outputs."""
+        return {
+            'format': self._outputFormat(),
+            'gpx': self.checkBoxGpx.isChecked(),
+            'generate_lines': self.checkBoxGenerateLines.isChecked(),
+            'clip': self._clipLead(),
+            'crs': crs_registry.identifier(self._outputCrs(self._rsCrs)),
+            'measure': self.checkBoxMeasure.isChecked(),
+            'altitude': self._altitude() if self.checkBoxMeasure.isChecked() else None,
+            'waypoints': [self.spinBoxWaypointSpacing.value(), self.spinBoxTurnRadius.value()]
+            if self.checkBoxWaypoints.isChecked() else None,
+            'samples': [self.spinBoxSpeed.value(), self._sampleRates()]
+            if self.checkBoxSamples.isChecked() else None,
+        }
+
+    def _clipLead(self):
+        """Returns run-in/run-out distance of clipped lines or None."""
+        return self.spinBoxLead.value() if self.checkBoxClip.isChecked() else None
+
+    def _refreshInput(self):
+        """Fetch again input files changed since prefetched, main file
+        is read again when changed."""
+        if not self._prefetcher:
+            return
+        try:
+            changed = self._prefetcher.refresh()
+        except (IOError, OSError) as e:
+            raise AerogenError(e)
+        if os.path.basename(self.textInput.toPlainText()) in changed:
+            self._ar = AerogenReader(self.textInput.toPlainText(), self._opener)
+
+    def OnWatch(self, checked):
+        if self._watcher:
+            self._watcher.stop()
+            self._watcher = None
+        if checked and self._ar and self._prefetcher:
+            self._watcher = AerogenWatcher(self.textInput.toPlainText(), parent=self)
+            self._watcher.changed.connect(self._onInputChanged)
+
+    def _onInputChanged(self, products):
+        """Regenerate products whose input files changed and refresh
+        already loaded layers in place."""
+        if not self._ar or not self._layers:
+            # nothing generated yet
+            return
+
+        if self._prefetcher:
+            for path in self._watcher.changedFiles(products):
+                self._prefetcher.invalidate(path)
+        try:
+            if 'area' in products:
+                self._ar = AerogenReader(self.textInput.toPlainText(), self._opener)
+                # lines depend on main file (clip polygon, CRS, offsets,
+                # area definition of generated lines)
+                products = products | {'sl', 'tl'}
+                self._generateLines(self._outputDir)
+
+            updated = []
+            for product in ('area', 'sl', 'tl'):
+                if product not in products:
+                    continue
+                name, __, crs = self._product(product)
+                geometries, fields, attributes = self._productFeatures(product)
+                layer = QgsProject.instance().mapLayer(self._layers.get(product, ''))
+                if isinstance(layer, AerogenLayer):
+                    layer.rewrite(geometries, crs, fields, attributes)
+                    self._writeGpx(layer, self._outputDir, self._ar.basename(), name)
+                    self._writeWaypoints(self._outputDir, self._ar.basename(), name, product)
+                    self._writeSamples(self._outputDir, self._ar.basename(), name, product)
+                else:
+                    # layer removed from the project meanwhile or loaded as up to date
+                    if layer is not None:
+                        QgsProject.instance().removeMapLayer(layer.id())
+                    layer = self._writeLayer(self._outputDir, self._ar.basename(), name, geometries, crs,
+                                             fields, attributes)
+                    self._writeWaypoints(self._outputDir, self._ar.basename(), name, product)
+                    self._writeSamples(self._outputDir, self._ar.basename(), name, product)
+                    self._addLayers([layer], self._ar.basename())
+                    self._layers[product] = layer.id()
+                    self._connectEdits(layer, product)
+                self._sessions.pop(layer.id(), None)
+                updated.append(name)
+
+            iface.messageBar().pushMessage(
+                self.tr("Info"),
+                self.tr("Updated {}").format(', '.join(updated)),
+                level=Qgis.Info
+            )
+        except (AerogenReaderError, AerogenReaderCRS, AerogenError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+
+    def _connectEdits(self, layer, product):
+        """Correct connections when endpoints of flight lines are moved in the layer."""
+        if product != 'area':
+            layer.committedGeometriesChanges.connect(partial(self._onLinesEdited, product))
+
+    def _onLinesEdited(self, product, layerId, geometries):
+        """Correct connections around moved line endpoints and update
+        the layer in place."""
+        layer = QgsProject.instance().mapLayer(layerId)
+        if not self._ar or layer is None:
+            return
+
+        try:
+            session = self._sessions.get(layerId)
+            if session is None:
+                session = self._sessions[layerId] = self._ar.session(product)
+            if layer.crs() == self._rsCrs:
+                to_utm = from_utm = None
+            else:
+                to_utm = crs_registry.transform(layer.crs(), self._rsCrs)
+                from_utm = crs_registry.transform(self._rsCrs, layer.crs())
+            session.edited(layer, geometries, to_utm)
+            session.patch(layer, session.update(), from_utm)
+        except (AerogenReaderError, AerogenError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+
+    def _addLayers(self, layers, group_name):
+        """Add layers at once into the layer tree group.
+
+        Canvas rendering is frozen until all layers are added.
+        """
+        canvas = iface.mapCanvas()
+        canvas.freeze(True)
+        try:
+            project = QgsProject.instance()
+            project.addMapLayers(layers, False)
+            root = project.layerTreeRoot()
+            group = root.findGroup(group_name)
+            if group is None:
+                group = root.insertGroup(0, group_name)
+            for layer in layers:
+                group.addLayer(layer)
+        finally:
+            canvas.freeze(False)
+            canvas.refresh()
+
+    def _writeLayer(self, output_dir, basename, name, geometries, crs,
+                    fields=None, attributes=None, style=None):
+        """Write product into vector file, apply style and optionally export GPX."""
+        # create a new vector file layer
+        driver = self._outputFormat()
+        output_file = os.path.join(output_dir, basename + '_{}{}'.format(name, FORMATS[driver][0]))
+        layer = AerogenLayer(output_file, geometries, crs, fields, attributes, driver)
+        style_input_file = self.stylePath(style or name)
+        # apply style for layer
+        apply_style(layer, style_input_file)
+        # also save the style into output directory with name of the output layer
+        style_output_file = os.path.join(output_dir, basename + '_{}.qml'.format(name))
+        layer.saveNamedStyle(style_output_file)
+        self._writeGpx(layer, output_dir, basename, name)
+
+        return layer
+
+    def _writeGpx(self, layer, output_dir, basename, name):
+        if self.checkBoxGpx.isChecked():
+            if layer.geometryType() == QgsWkbTypes.LineGeometry:
+                # generate gpx output also for tie and survey lines
+                output_file_gpx = os.path.join(output_dir, basename + '_{}.gpx'.format(name))
+                QgsVectorFileWriter.writeAsVectorFormat(layer = layer,
+                                                        fileName = output_file_gpx,
+                                                        driverName = "GPX",
+                                                        fileEncoding = "UTF-8",
+                                                        destCRS = self._wgsCrs(),
+                                                        layerOptions = ["FORCE_GPX_TRACK = YES"],
+                                                        skipAttributeCreation = True
+                )
+
+    def _writeWaypoints(self, output_dir, basename, name, product):
+        """Export lines densified to waypoints (CSV and optionally GPX)."""
+        if product == 'area' or not self.checkBoxWaypoints.isChecked():
+            return
+
+        waypoints = AerogenWaypoints(self._ar.line_array(product), self._ar.line_ids(product),
+                                     self.spinBoxWaypointSpacing.value(),
+                                     self.spinBoxTurnRadius.value())
+        xform = crs_registry.transform(self._rsCrs, self._wgsCrs())
+        output_file = os.path.join(output_dir, basename + '_{}.waypoints'.format(name))
+        try:
+            waypoints.write_csv(output_file + '.csv', xform)
+            if self.checkBoxGpx.isChecked():
+                waypoints.write_gpx(output_file + '.gpx', xform, basename + '_' + name)
+        except IOError as e:
+            raise AerogenError(e)
+
+    def _sampleRates(self):
+        """Returns list of sample rates or None if simulation is disabled."""
+        if not self.checkBoxSamples.isChecked():
+            return None
+        try:
+            return [float(rate) for rate in self.lineEditRates.text().split(',') if rate.strip()]
+        except ValueError:
+            raise AerogenError(self.tr("Invalid sample rates '{}'").format(self.lineEditRates.text()))
+
+    def _writeSamples(self, output_dir, basename, name, product):
+        """Write simulated instrument samples for each sample rate."""
+        rates = self._sampleRates()
+        if product == 'area' or not rates:
+            return
+
+        xy = self._ar.line_array(product)
+        ids = self._ar.line_ids(product)
+        parquet = self._outputFormat() == 'Parquet'
+        for rate in rates:
+            sampler = AerogenSampler(xy, ids, self.spinBoxSpeed.value(), rate)
+            output_file = os.path.join(output_dir, basename + '_{}.samples_{:g}hz'.format(name, rate))
+            try:
+                if parquet:
+                    sampler.write_parquet(output_file + '.parquet', crs_registry.identifier(self._rsCrs))
+                else:
+                    sampler.write_csv(output_file + '.csv')
+            except IOError as e:
+                raise AerogenError(e)
+
+    def OnMosaic(self):
+        sender = 'AeroGen-{}-lastUserMosaicPath'.format(self.sender().objectName())
+        # load lastly used directory path
+        lastPath = self._settings.value(sender, '')
+
+        directoryPath = QFileDialog.getExistingDirectory(
+            self, self.tr("Directory with survey directories"), lastPath
+        )
+        if not directoryPath:
+            # action canceled
+            return
+
+        directoryPath = os.path.normpath(directoryPath)
+        # remember directory path
+        self._settings.setValue(sender, directoryPath)
+
+        output_dir = self.textOutput.toPlainText() or directoryPath
+        basename = os.path.basename(directoryPath) + '_mosaic'
+        try:
+            mosaic = AerogenMosaic(AerogenMosaic.directories(directoryPath),
+                                   self.checkBoxGenerateLines.isChecked())
+            fields = mosaic.fields()
+            attributes = mosaic.attributes()
+            # overlaps and gaps are checked in metric CRS of the first survey
+            polygons = mosaic.area()
+            crs = self._outputCrs(mosaic.crs())
+            layers = []
+            for name, geometries in (('polygon', mosaic.area(crs)),
+                                     ('survey_lines', mosaic.sl(crs)),
+                                     ('tie_lines', mosaic.tl(crs))):
+                layer = self._writeLayer(output_dir, basename, name, geometries, crs,
+                                         fields, attributes)
+                # one spatial index for the whole campaign (FlatGeobuf has its own)
+                if layer.dataProvider().capabilities() & QgsVectorDataProvider.CreateSpatialIndex:
+                    layer.dataProvider().createSpatialIndex()
+                layers.append(layer)
+
+            # overlaps and gaps between blocks
+            issue_fields = QgsFields()
+            for field_name in ('survey1', 'survey2'):
+                issue_fields.append(QgsField(field_name, QVariant.String))
+            overlaps, gaps = mosaic.check(polygons)
+            xform = crs_registry.transform(mosaic.crs(), crs)
+            for name, issues, style in (('overlaps', overlaps, 'polygon'),
+                                        ('gaps', gaps, 'survey_lines')):
+                if not issues:
+                    continue
+                geometries = [issue[2] for issue in issues]
+                if crs != mosaic.crs():
+                    for geom in geometries:
+                        geom.transform(xform)
+                layers.append(self._writeLayer(
+                    output_dir, basename, name, geometries,
+                    crs, issue_fields, [issue[:2] for issue in issues], style
+                ))
+
+            self._addLayers(layers, basename)
+
+            iface.messageBar().pushMessage(
+                self.tr("Success"),
+                self.tr("Mosaic of {} surveys saved to {} ({} overlaps, {} gaps)").format(
+                    len(mosaic.surveys()), output_dir, len(overlaps), len(gaps)),
+                level=Qgis.Success
+            )
+        except (AerogenReaderError, AerogenReaderCRS, AerogenError) as e:
+            iface.messageBar().pushMessage(self.tr("Error"),
+                                           "{}".format(e),
+                                           level=Qgis.Critical
+            )
+
+    def _outputFormat(self):
+        """Returns GDAL driver name of selected output format."""
+        return ('ESRI Shapefile', 'FlatGeobuf', 'Parquet')[self.comboBoxFormat.currentIndex()]
+
+    def _cacheDir(self):
+        """Returns local cache directory for input files or None if disabled."""
+        if not self.checkBoxCache.isChecked():
+            return None
+        return os.path.join(
+            QStandardPaths.writableLocation(QStandardPaths.CacheLocation), 'AeroGen'
+        )
+
+    def _wgsCrs(self):
+        return crs_registry.crs(4326)
+
+    def _generateLines(self, output_dir):
+        """Generate survey and tie lines from area polygon if requested."""
+        generate = self.checkBoxGenerateLines.isChecked()
+        self._ar.set_generate_lines(generate)
+        self._ar.set_clip_lines(self._clipLead())
+        if not generate or not self.checkBoxXyz.isChecked():
+            return
+
+        if os.path.normpath(output_dir) == os.path.normpath(self._ar.dirname()):
+            # do not overwrite vendor files
+            raise AerogenError(
+                self.tr("Choose output directory different from input directory to save generated lines")
+            )
+        for type in ('sl', 'tl'):
+            output_file = os.path.join(output_dir, self._ar.basename() + '_{}.xyz'.format(type))
+            self._ar.write_generated_lines(type, output_file)
+
     def OnBrowseOutput(self):
         sender = 'AeroGen-{}-lastUserOutputFilePath'.format(self.sender().objectName())
         # load lastly used directory path
@@ -201,15 +903,8 @@ class AeroGenDockWidget(QDockWidget, FORM_CLASS):
         return stylePath
 
     def _getMainXyzFile(self, directoryPath):
-        for filename in os.listdir(directoryPath):
-            if filename.endswith(".xyz"):
-                try:
-                    with open(os.path.join(directoryPath, filename)) as f:
-                        line = f.readline()
-                        # Not a nice detection, but if we base the detection of the main file
-                        # on the filename it may be even worse
-                        if line.startswith('UTM'):
-                            return filename
-                except:
-                    raise AerogenError(self.tr("Directory is corrupted. The file '{}' can not be read").format(filename))
-
+        try:
+            opener = self._prefetcher.open if self._prefetcher else open
+            return main_xyz_file(directoryPath, opener)
+        except AerogenReaderError as e:
+            raise AerogenError(self.tr("Directory is corrupted. The file '{}' can not be read").format(e))
@@ -1,33 +1,102 @@
 import os
+import glob
+import shutil
 
-from qgis.core import QgsVectorLayer, QgsFeature, QgsVectorFileWriter, QgsFields
+from qgis.core import (QgsVectorLayer, QgsFeature, QgsVectorFileWriter, QgsFields,
+                       QgsDataProvider, QgsProject)
 from .exceptions import AerogenError
 
+# supported output formats: driver name -> (file extension, layer options)
+FORMATS = {
+    'ESRI Shapefile': ('.shp', []),
+    # packed Hilbert R-tree stored in the file
+    'FlatGeobuf': ('.fgb', ['SPATIAL_INDEX=YES']),
+    # GeoParquet, geometries stored as WKB column in row groups
+    'Parquet': ('.parquet', ['GEOMETRY_ENCODING=WKB', 'ROW_GROUP_SIZE=65536']),
+}
+
+def format_available(driver):
+    """Check if output format is supported by GDAL used by QGIS."""
+    return driver in [fmt.driverName for fmt in QgsVectorFileWriter.supportedFiltersAndFormats()]
+
 class AerogenLayer(QgsVectorLayer):
-    def __init__(self, filename, geometries, crs=None):
-        """Aerogen Shapefile layer.
+    def __init__(self, filename, geometries, crs=None, fields=None, attributes=None,
+                 driver="ESRI Shapefile"):
+        """Aerogen vector file layer.
+
+        :param fields: optional QgsFields
+        :param attributes: list of attribute values for each geometry
+        :param driver: output format, see FORMATS
         """
         name = os.path.splitext(os.path.basename(filename))[0]
+        self._filename = filename
+        self._driver = driver
 
-        layer = self._createLayer(filename, crs, geometries)
+        layer = self._createLayer(filename, crs, geometries, fields, attributes)
 
         super(AerogenLayer, self).__init__(filename,
                                            name, "ogr")
 
-    def _createLayer(self, filename, crs, geometries):
+    def rewrite(self, geometries, crs=None, fields=None, attributes=None):
+        """Rewrite data file and reload layer data.
+
+        Data are written into temporary file first and the layer is
+        switched to it, so that the data file is not open by OGR while
+        overwritten, then the layer is switched back.
+        """
+        root, ext = os.path.splitext(self._filename)
+        tmp_root = root + '.tmp'
+        self._createLayer(tmp_root + ext, crs or self.crs(), geometries, fields, attributes)
+        # data file with all sidecar files (.shx, .dbf, .prj, ...)
+        tmp_files = glob.glob(glob.escape(tmp_root) + '.*')
+
+        options = QgsDataProvider.ProviderOptions()
+        options.transformContext = QgsProject.instance().transformContext()
+        self.setDataSource(tmp_root + ext, self.name(), "ogr", options)
+        try:
+            for tmp_file in tmp_files:
+                shutil.copyfile(tmp_file, root + tmp_file[len(tmp_root):])
+        except (IOError, OSError) as e:
+            raise AerogenError('Failed rewriting {}: {}'.format(self._filename, e))
+        finally:
+            self.setDataSource(self._filename, self.name(), "ogr", options)
+            # drop pooled connections opened before rewriting
+            self.dataProvider().reloadData()
+        for tmp_file in tmp_files:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                # still open by connection pool (Windows)
+                pass
+
+        self.updateExtents()
+        self.triggerRepaint()
+
+    def _createLayer(self, filename, crs, geometries, fields=None, attributes=None):
         if len(geometries) < 1:
             raise AerogenError(self.tr("No features to write"))
+        if self._driver not in FORMATS or not format_available(self._driver):
+            raise AerogenError(
+                'Output format {} is not supported'.format(self._driver)
+            )
         geom_type = geometries[0].wkbType()
 
-        writer = QgsVectorFileWriter(filename, "UTF-8", QgsFields(),
-                                     geom_type, crs, "ESRI Shapefile")
+        writer = QgsVectorFileWriter(filename, "UTF-8", fields or QgsFields(),
+                                     geom_type, crs, self._driver,
+                                     [], FORMATS[self._driver][1])
 
         if writer.hasError() != QgsVectorFileWriter.NoError:
             raise AerogenError(
-                'Failed creating Shapefile: {}'.format(writer.errorMessage())
+                'Failed creating {}: {}'.format(self._driver, writer.errorMessage())
             )
 
-        for geom in geometries:
+        for i, geom in enumerate(geometries):
             fet = QgsFeature()
+            if fields:
+                fet.setFields(fields)
+                fet.setAttributes(attributes[i])
             fet.setGeometry(geom)
             writer.addFeature(fet)
+
+        # flush features and write spatial index
+        del writer
@@ -0,0 +1,199 @@
+import io
+import os
+import gzip
+import lzma
+import tarfile
+import zipfile
+
+from .exceptions import AerogenError
+
+# suffixes of auxiliary survey files, never the main file
+AUX_SUFFIXES = ('_sl', '_tl', '_crs', '_sl_LatLon', '_tl_LatLon')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz', '.tar.bz2', '.tar.zst', '.tzst')
+
+def _zstd_open(path):
+    try:
+        import zstandard
+    except ImportError:
+        raise AerogenError("Python module zstandard is required to read .zst files")
+    return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+# single file decompressors
+COMPRESSORS = {
+    '.gz': lambda path: gzip.open(path, 'rb'),
+    '.xz': lambda path: lzma.open(path, 'rb'),
+    '.zst': _zstd_open,
+}
+
+class AerogenArchive(object):
+    def __init__(self, path):
+        """Compressed or archived survey delivery.
+
+        Supported are zip and tar (optionally gz, xz, bz2 or zst
+        compressed) archives and single files compressed by gzip, xz or
+        zstd (eg. area.xyz.gz) together with survey files next to them
+        (area_sl.xyz.gz, area_tl.xyz.gz, area_crs.xyz.gz, ...). Nothing
+        is extracted to disk nor held in memory, members are decompressed
+        in a streaming way. Members of uncompressed tar archives are read
+        directly from their offsets, compressed tar archives are streamed
+        from the start till the member is reached.
+
+        :param path: archive or compressed file
+        """
+        self._path = path
+        lower = path.lower()
+        if lower.endswith(TAR_EXTENSIONS):
+            self._kind = 'tar'
+        elif zipfile.is_zipfile(path):
+            self._kind = 'zip'
+        elif os.path.splitext(lower)[1] in COMPRESSORS:
+            self._kind = 'file'
+        else:
+            raise AerogenError("Unsupported archive {}".format(path))
+
+        # tar member headers by member name
+        self._infos = {}
+        self._members = self._list()
+
+    def path(self):
+        return self._path
+
+    def members(self):
+        """Returns names of XYZ members."""
+        return sorted(self._members.keys())
+
+    def main_file(self):
+        """Detect main XYZ file from member names and first bytes."""
+        candidates = sorted(self.members(),
+                            key=lambda name: os.path.splitext(name)[0].endswith(AUX_SUFFIXES))
+        for name in candidates:
+            with self.open(name, 'rb') as f:
+                if f.read(3) == b'UTM':
+                    return name
+
+        return None
+
+    def open(self, path, mode='r'):
+        """Open member as stream, path can be member name or any path ending with it.
+
+        Can be passed to AerogenReader as opener.
+        """
+        name = os.path.basename(path)
+        if name not in self._members:
+            raise IOError("{} not found in {}".format(name, self._path))
+
+        stream = self._open(self._members[name])
+        if 'b' in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding='utf-8', errors='replace')
+
+    def _list(self):
+        """Returns mapping of member file names to archive entries."""
+        if self._kind == 'file':
+            return self._siblings()
+
+        if self._kind == 'zip':
+            with zipfile.ZipFile(self._path) as z:
+                names = [info.filename for info in z.infolist() if not info.is_dir()]
+        else:
+            names = self._list_tar()
+
+        members = {}
+        for name in names:
+            filename = os.path.basename(name)
+            if filename.endswith('.xyz'):
+                members[filename] = name
+
+        return members
+
+    def _siblings(self):
+        """Returns mapping of survey file names to compressed files in
+        the directory of compressed file."""
+        directory, filename = os.path.split(self._path)
+        # area_sl.xyz.gz -> area
+        base = os.path.splitext(os.path.splitext(filename)[0])[0]
+        for suffix in AUX_SUFFIXES:
+            if base.endswith(suffix):
+                base = base[:-len(suffix)]
+                break
+        survey = [base + suffix + '.xyz' for suffix in ('',) + AUX_SUFFIXES]
+
+        members = {}
+        for name in sorted(os.listdir(directory or os.curdir)):
+            root, ext = os.path.splitext(name)
+            if ext.lower() in COMPRESSORS and root in survey:
+                # area.xyz.gz -> area.xyz
+                members[root] = os.path.join(directory, name)
+
+        return members
+
+    def _compressed_tar(self):
+        return not self._path.lower().endswith('.tar')
+
+    def _stream_tar(self):
+        """Returns tar archive opened for sequential reading and its file object."""
+        if self._path.lower().endswith(('.tar.zst', '.tzst')):
+            fileobj, mode = _zstd_open(self._path), 'r|'
+        else:
+            fileobj, mode = open(self._path, 'rb'), 'r|*'
+        try:
+            return tarfile.open(fileobj=fileobj, mode=mode), fileobj
+        except (tarfile.TarError, IOError, OSError):
+            fileobj.close()
+            raise
+
+    def _list_tar(self):
+        """Returns names of file members of tar archive, headers of
+        uncompressed archive are kept to read members from their offsets."""
+        if self._compressed_tar():
+            t, fileobj = self._stream_tar()
+            with fileobj, t:
+                return [member.name for member in t if member.isfile()]
+
+        with tarfile.open(self._path, mode='r:') as t:
+            names = []
+            for member in t:
+                if member.isfile():
+                    names.append(member.name)
+                    self._infos[member.name] = member
+            return names
+
+    def _open(self, entry):
+        if self._kind == 'zip':
+            z = zipfile.ZipFile(self._path)
+            return _ClosingStream(z.open(entry), z)
+        if self._kind == 'tar':
+            if not self._compressed_tar():
+                # seek to member data, no headers are read
+                t = tarfile.open(self._path, mode='r:')
+                return _ClosingStream(t.extractfile(self._infos[entry]), t)
+            t, fileobj = self._stream_tar()
+            for member in t:
+                if member.name == entry:
+                    return _ClosingStream(t.extractfile(member), t, fileobj)
+            t.close()
+            fileobj.close()
+            raise IOError("{} not found in {}".format(entry, self._path))
+        ext = os.path.splitext(entry)[1].lower()
+        return COMPRESSORS[ext](entry)
+
+class _ClosingStream(io.RawIOBase):
+    """Member stream closing also its archive and archive file objects."""
+    def __init__(self, stream, *archive):
+        self._stream = stream
+        self._archive = archive
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+            for item in self._archive:
+                item.close()
+        super(_ClosingStream, self).close()
@@ -0,0 +1,239 @@
+import math
+
+import numpy as np
+
+from .parallel import map_ordered
+
+# intersections closer to the origin are considered invalid (spurious
+# intersection results close to 0 0 seen on Windows)
+INTERSECTION_ERROR_LIMIT = 0.000000000001
+
+# number of lines corrected by one worker task
+CHUNK_LINES = 50000
+# lines corrected before chunk start so that speculative state usually
+# matches the serial one at chunk seam
+WARMUP_LINES = 8
+
+def azimuth(a, b):
+    """Returns azimuth of b from a in degrees (same as QgsPointXY.azimuth)."""
+    return math.atan2(b[0] - a[0], b[1] - a[1]) * 180.0 / math.pi
+
+def azimuth_diff(pt1, pt2, pt3):
+    """Returns difference between azimuths of two lines (pt1-pt2 and pt2-pt3)"""
+    first_segment_azimuth = azimuth(pt1, pt2)
+    if first_segment_azimuth < 0:
+        first_segment_azimuth += 360
+    second_segment_azimuth = azimuth(pt2, pt3)
+    if second_segment_azimuth < 0:
+        second_segment_azimuth += 360
+    return first_segment_azimuth - second_segment_azimuth
+
+def distance(a, b):
+    return math.hypot(b[0] - a[0], b[1] - a[1])
+
+def rotate(point, angle, center):
+    """Rotate point clockwise by angle in degrees (same as QgsGeometry.rotate)."""
+    radians = angle * math.pi / 180.0
+    cos, sin = math.cos(radians), math.sin(radians)
+    x, y = point[0] - center[0], point[1] - center[1]
+    return (center[0] + x * cos + y * sin, center[1] - x * sin + y * cos)
+
+def extend(a, b, start, end):
+    """Extend segment by distances at start and end (same as QgsLineString.extend)."""
+    length = distance(a, b)
+    if length == 0:
+        return a, b
+    if start > 0:
+        a = (b[0] + (a[0] - b[0]) / length * (length + start),
+             b[1] + (a[1] - b[1]) / length * (length + start))
+    if end > 0:
+        b = (a[0] + (b[0] - a[0]) / length * (length + end),
+             a[1] + (b[1] - a[1]) / length * (length + end))
+    return a, b
+
+def intersection(a, b, c, d):
+    """Returns centroid of intersection of segments a-b and c-d or None."""
+    rx, ry = b[0] - a[0], b[1] - a[1]
+    sx, sy = d[0] - c[0], d[1] - c[1]
+    qx, qy = c[0] - a[0], c[1] - a[1]
+    denominator = rx * sy - ry * sx
+    if denominator == 0:
+        if qx * ry - qy * rx != 0 or (rx == 0 and ry == 0):
+            # parallel or degenerated
+            return None
+        # collinear, centroid of overlapping part
+        length2 = rx * rx + ry * ry
+        t1 = (qx * rx + qy * ry) / length2
+        t2 = t1 + (sx * rx + sy * ry) / length2
+        low, high = max(0.0, min(t1, t2)), min(1.0, max(t1, t2))
+        if low > high:
+            return None
+        t = (low + high) / 2
+        return (a[0] + t * rx, a[1] + t * ry)
+
+    t = (qx * sy - qy * sx) / denominator
+    u = (qx * ry - qy * rx) / denominator
+    if t < 0 or t > 1 or u < 0 or u > 1:
+        return None
+    return (a[0] + t * rx, a[1] + t * ry)
+
+def correct_first_segment(points):
+    """Switch first two points if the connection is not in good angle (close to normal).
+    It usually means that we took the first line in a wrong dirrection.
+    """
+    if len(points) < 4:
+        return points
+    diff = azimuth_diff(points[0], points[1], points[2])
+    if (math.fabs(diff) > 70 and math.fabs(diff) < 110) \
+            or (math.fabs(diff) > 250 and math.fabs(diff) < 290):
+        # If the angle is about normal / 90 degrees, we do not do anything
+        return points
+    if distance(points[0], points[1]) < (distance(points[2], points[3]) / 2):
+        points[0], points[1] = points[1], points[0]
+    return points
+
+def correct_step(points, i, previous_diff, offset=0):
+    """Prolong lines at connection i (points i+1 and i+2) when the
+    connection is not in normal angle.
+
+    Only point i+1 or i+2 is modified in place, the step reads points
+    i..i+3 (and 2..4 for the first connection).
+
+    :param points: list of (x, y) tuples
+    :param i: index of the first point of the line before connection
+    :param previous_diff: azimuth difference of previous connection
+    :param offset: index of points[0] in the whole flight path
+
+    :return: azimuth difference of this connection
+    """
+    diff = azimuth_diff(points[i], points[i + 1], points[i + 2])
+    if (math.fabs(diff) > 85 and math.fabs(diff) < 95) or (math.fabs(diff) > 265 and math.fabs(diff) < 275):
+        return diff
+
+    # The angle is not close to normal
+    if i + offset == 0 and len(points) > 4:
+        # We are at the beginning and do not have previous diff, so we read next diff
+        previous_diff = azimuth_diff(points[2], points[3], points[4])
+    distance_current = distance(points[i], points[i + 1])
+    distance_next = distance(points[i + 2], points[i + 3])
+    # We rotate the connection to find cross with extended line, the rotation
+    # is based on diff (rotate to be along extended line) and angle of the
+    # previous normal line
+    angle = diff + (180 - previous_diff)
+    if distance_current > distance_next:
+        # we go from longer to shorter line
+        line = extend(points[i + 2], points[i + 3], distance_current, 0)
+        center, index = points[i + 1], i + 2
+    else:
+        # we go from shorter to longer line
+        line = extend(points[i], points[i + 1], 0, distance_next)
+        center, index = points[i + 2], i + 1
+    connection = (rotate(points[i + 1], angle, center), rotate(points[i + 2], angle, center))
+    point = intersection(connection[0], connection[1], line[0], line[1])
+    if point is not None and point[0] > INTERSECTION_ERROR_LIMIT and point[1] > INTERSECTION_ERROR_LIMIT:
+        points[index] = point
+
+    return diff
+
+def correct_connections(points, start=0, previous_diff=90):
+    """Run connection correction from step start till the end of path.
+
+    :param points: list of (x, y) tuples, modified in place
+
+    :return: list of azimuth differences entering each step (step i
+    at index i // 2)
+    """
+    previous = []
+    i = start
+    while i < (len(points) - 3):
+        previous.append(previous_diff)
+        previous_diff = correct_step(points, i, previous_diff)
+        i += 2
+    return previous
+
+def _correct_chunk(task):
+    """Correct connections of flight path slice from given state.
+
+    Module level function so that it can be run in worker processes.
+
+    :return: tuple of corrected slice, its offset, azimuth differences
+    entering each step and azimuth difference of the last step
+    """
+    xy, offset, previous_diff = task
+    points = [tuple(p) for p in xy.tolist()]
+    previous = []
+    i = 0
+    while i < (len(points) - 3):
+        previous.append(previous_diff)
+        previous_diff = correct_step(points, i, previous_diff, offset)
+        i += 2
+    return np.array(points, dtype=float).reshape(-1, 2), offset, previous, previous_diff
+
+def _chunk_tasks(xy, steps, chunk_lines):
+    """Yield path slices read by chunks of steps including warm-up steps."""
+    for start in range(0, steps, chunk_lines):
+        stop = min(start + chunk_lines, steps)
+        warmup = max(start - WARMUP_LINES, 0)
+        # the first step reads points up to 4
+        end = min(len(xy), max(2 * stop + 2, 5))
+        yield xy[2 * warmup:end], 2 * warmup, 90
+
+def _correct_parallel(xy, workers, chunk_lines):
+    """Correct connections in chunks on process pool.
+
+    Chunks are corrected speculatively from the state after warm-up
+    steps. At each seam steps are run serially from the state left by
+    the previous chunk till the point and azimuth difference entering
+    a step match the chunk, so that the result is identical to
+    correct_connections().
+    """
+    steps = max((len(xy) - 2) // 2, 0)
+    previous = []
+    # state entering step i
+    i = 0
+    point, previous_diff = tuple(xy[0].tolist()) if len(xy) else None, 90
+    for chunk, offset, chunk_previous, chunk_diff in map_ordered(
+            _correct_chunk, _chunk_tasks(xy, steps, chunk_lines), workers):
+        stop = min(i + 2 * chunk_lines, 2 * steps)
+        while i < stop:
+            xy[i] = point
+            if point == tuple(chunk[i - offset].tolist()) \
+                    and previous_diff == chunk_previous[(i - offset) // 2]:
+                # the rest of chunk is the same as in serial run
+                xy[i + 1:stop + 1] = chunk[i + 1 - offset:stop + 1 - offset]
+                previous.extend(chunk_previous[(i - offset) // 2:(stop - offset) // 2])
+                point, previous_diff = tuple(chunk[stop - offset].tolist()), chunk_diff
+                i = stop
+                break
+            # serial step at seam
+            window = [point] + [tuple(p) for p in xy[i + 1:i + 4].tolist()]
+            previous.append(previous_diff)
+            previous_diff = correct_step(window, 0, previous_diff, i)
+            xy[i + 1] = window[1]
+            point = window[2]
+            i += 2
+    if len(xy):
+        xy[i] = point
+
+    return xy, previous
+
+def correct_path(xy, workers=0, chunk_lines=CHUNK_LINES):
+    """Correct first segment and connections of flight path.
+
+    :param xy: flight path as (n, 2) array, line k is defined by points
+    2k and 2k+1
+    :param workers: number of worker processes correcting chunks of
+    the path, 0 to correct the path in the current process
+    :param chunk_lines: number of lines in one chunk
+
+    :return: tuple of corrected (n, 2) array and list of azimuth
+    differences entering each connection step
+    """
+    if workers and len(xy) // 2 > chunk_lines:
+        xy = np.array(xy, dtype=float).reshape(-1, 2)
+        head = correct_first_segment([tuple(p) for p in xy[:4].tolist()])
+        xy[:len(head)] = head
+        return _correct_parallel(xy, workers, chunk_lines)
+    points = correct_first_segment([(float(x), float(y)) for x, y in xy])
+    previous = correct_connections(points)
+    return np.array(points, dtype=float).reshape(-1, 2), previous
@@ -0,0 +1,92 @@
+import uuid
+import threading
+from functools import partial
+
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
+
+_lock = threading.RLock()
+# CRS definitions by key
+_crs = {}
+# transforms by (source key, destination key, project key)
+_transforms = {}
+# projects whose transform context changes drop their transforms
+_projects = set()
+# dynamic property of project holding its key, unlike id() the key is
+# never reused by another project
+PROJECT_KEY_PROPERTY = 'aerogen_crs_registry_key'
+
+def identifier(crs):
+    """Returns authority identifier of CRS (eg. EPSG:32633), WKT for
+    custom CRS without authority identifier."""
+    return crs.authid() or crs.toWkt(QgsCoordinateReferenceSystem.WKT_PREFERRED)
+
+def _key(definition):
+    if isinstance(definition, QgsCoordinateReferenceSystem):
+        return identifier(definition)
+    if isinstance(definition, int):
+        return 'EPSG:{}'.format(definition)
+    return str(definition)
+
+def crs(definition):
+    """Returns CRS from process-wide cache.
+
+    :param definition: EPSG code, CRS definition string (eg. 'EPSG:4326')
+    or QgsCoordinateReferenceSystem
+    """
+    key = _key(definition)
+    with _lock:
+        result = _crs.get(key)
+        if result is None:
+            if isinstance(definition, QgsCoordinateReferenceSystem):
+                result = QgsCoordinateReferenceSystem(definition)
+            else:
+                result = QgsCoordinateReferenceSystem(key)
+            _crs[key] = result
+        # implicitly shared copy, safe to use from other threads
+        return QgsCoordinateReferenceSystem(result)
+
+def transform(source, destination, project=None):
+    """Returns coordinate transform from process-wide cache.
+
+    Cached transforms of the project are dropped when its transform
+    context changes.
+
+    :param source: source CRS (see crs())
+    :param destination: destination CRS (see crs())
+    :param project: project providing transform context, current
+    project if not given
+    """
+    project = project or QgsProject.instance()
+    with _lock:
+        project_key = _project_key(project)
+        key = (_key(source), _key(destination), project_key)
+        result = _transforms.get(key)
+        if result is None:
+            result = QgsCoordinateTransform(crs(source), crs(destination), project)
+            _transforms[key] = result
+        return QgsCoordinateTransform(result)
+
+def _project_key(project):
+    """Returns key of project, drop of its transforms is connected to
+    project signals on first use."""
+    project_key = project.property(PROJECT_KEY_PROPERTY)
+    if not project_key:
+        project_key = uuid.uuid4().hex
+        project.setProperty(PROJECT_KEY_PROPERTY, project_key)
+    if project_key not in _projects:
+        _projects.add(project_key)
+        project.transformContextChanged.connect(partial(_clear_project, project_key))
+        project.destroyed.connect(partial(_clear_project, project_key))
+    return project_key
+
+def _clear_project(project_key, *args):
+    """Drop cached transforms of project."""
+    with _lock:
+        for key in [key for key in _transforms if key[2] == project_key]:
+            del _transforms[key]
+
+def clear():
+    """Drop all cached definitions and transforms."""
+    with _lock:
+        _crs.clear()
+        _transforms.clear()
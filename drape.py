@@ -0,0 +1,256 @@
+import collections
+
+import numpy as np
+
+from .geometry import polyline_geometry, transform_array
+from .waypoints import format_fixed, compose
+from .exceptions import AerogenError
+from . import crs_registry
+
+# number of DEM blocks kept in memory
+CACHE_BLOCKS = 256
+
+PROFILE_COLUMNS = ('line', 'distance', 'x', 'y', 'ground', 'altitude')
+
+class AerogenDem(object):
+    def __init__(self, filename, cache_blocks=CACHE_BLOCKS):
+        """Digital elevation model read by blocks.
+
+        Only blocks touched by sampled points are read, at most
+        cache_blocks of them are kept in memory (least recently used
+        are dropped).
+
+        :param filename: raster file readable by GDAL (eg. GeoTIFF)
+        :param cache_blocks: size of block cache
+        """
+        from osgeo import gdal
+
+        self._dataset = gdal.Open(filename)
+        if self._dataset is None:
+            raise AerogenError("Unable to open DEM {}".format(filename))
+        x0, dx, rx, y0, ry, dy = self._dataset.GetGeoTransform()
+        if rx or ry:
+            raise AerogenError("Rotated DEM {} is not supported".format(filename))
+        self._origin = np.array([x0, y0])
+        self._pixel = np.array([dx, dy])
+
+        self._band = self._dataset.GetRasterBand(1)
+        self._size = np.array([self._dataset.RasterXSize, self._dataset.RasterYSize])
+        self._block = np.array(self._band.GetBlockSize())
+        self._nodata = self._band.GetNoDataValue()
+        self._cache = collections.OrderedDict()
+        self._cache_blocks = cache_blocks
+
+    def crs(self):
+        """Returns CRS of the DEM."""
+        return crs_registry.crs(self._dataset.GetProjection())
+
+    def _read_block(self, bx, by):
+        key = (bx, by)
+        block = self._cache.get(key)
+        if block is not None:
+            self._cache.move_to_end(key)
+            return block
+
+        x, y = bx * self._block[0], by * self._block[1]
+        width = min(self._block[0], self._size[0] - x)
+        height = min(self._block[1], self._size[1] - y)
+        block = self._band.ReadAsArray(int(x), int(y), int(width), int(height)).astype(float)
+        if self._nodata is not None:
+            block[block == self._nodata] = np.nan
+        self._cache[key] = block
+        if len(self._cache) > self._cache_blocks:
+            self._cache.popitem(last=False)
+
+        return block
+
+    def _values(self, cols, rows):
+        """Returns pixel values, NaN outside of the raster."""
+        values = np.full(len(cols), np.nan)
+        inside = (cols >= 0) & (rows >= 0) & (cols < self._size[0]) & (rows < self._size[1])
+        cols, rows = cols[inside], rows[inside]
+        bx, by = cols // self._block[0], rows // self._block[1]
+        keys = bx * (self._size[1] // self._block[1] + 1) + by
+        result = np.empty(len(cols))
+        # points are grouped by block, each block is read once
+        order = np.argsort(keys, kind='stable')
+        unique, starts = np.unique(keys[order], return_index=True)
+        for start, stop in zip(starts, np.append(starts[1:], len(order))):
+            index = order[start:stop]
+            block = self._read_block(bx[index[0]], by[index[0]])
+            result[index] = block[rows[index] - by[index[0]] * self._block[1],
+                                  cols[index] - bx[index[0]] * self._block[0]]
+        values[inside] = result
+
+        return values
+
+    def sample(self, xy):
+        """Bilinear interpolation of DEM at (n, 2) array of points in DEM CRS.
+
+        Returns NaN outside of the raster or near no data pixels.
+        """
+        # pixel coordinates relative to pixel centers
+        position = (np.asarray(xy, dtype=float) - self._origin) / self._pixel - 0.5
+        # half pixel along the raster edge is extrapolated from the edge pixels
+        position = np.where((position > -0.5) & (position < 0), 0, position)
+        last = self._size - 1
+        position = np.where((position > last) & (position < last + 0.5), last, position)
+        base = np.floor(position).astype(np.int64)
+        fraction = position - base
+        cols, rows = base[:, 0], base[:, 1]
+        fx, fy = fraction[:, 0], fraction[:, 1]
+        # neighbour outside of raster is not needed for zero weight
+        right = np.where(fx > 0, cols + 1, cols)
+        below = np.where(fy > 0, rows + 1, rows)
+
+        # all four neighbours at once, so that each block is read once
+        values = self._values(np.concatenate((cols, right, cols, right)),
+                              np.concatenate((rows, rows, below, below))).reshape(4, -1)
+        weights = np.vstack(((1 - fx) * (1 - fy), fx * (1 - fy), (1 - fx) * fy, fx * fy))
+
+        return (values * weights).sum(axis=0)
+
+def densify(xy, spacing=None):
+    """Densify flight lines at given spacing, line endpoints are kept.
+
+    :param xy: flight path as (n, 2) array, line k is defined by points
+    2k and 2k+1
+    :param spacing: distance of points in meters, only endpoints if not given
+
+    :return: tuple of line indices, distances from line start and (n, 2)
+    array of points
+    """
+    count = len(xy) // 2
+    start = xy[0:2 * count:2]
+    ab = xy[1:2 * count:2] - start
+    length = np.hypot(*ab.T)
+    if spacing:
+        counts = np.maximum(np.ceil(length / spacing).astype(np.int64) + 1, 2)
+    else:
+        counts = np.full(count, 2, dtype=np.int64)
+    line = np.repeat(np.arange(count), counts)
+    j = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    step = length / np.maximum(counts - 1, 1)
+    distance = np.minimum(j * step[line], length[line])
+    t = distance / np.where(length > 0, length, 1)[line]
+
+    return line, distance, start[line] + t[:, np.newaxis] * ab[line]
+
+def _group_accumulate(values, line):
+    """Cumulative maximum restarted at each line (lines in ascending order)."""
+    if len(values) == 0:
+        return values
+    # shift lines so that maximum of previous lines never exceeds current line
+    shift = (np.nanmax(values) - np.nanmin(values) + 1) * line
+    return np.maximum.accumulate(values + shift) - shift
+
+def limit_profile(target, distance, line, climb, descent):
+    """Lowest altitude profile above target respecting climb and descent gradients.
+
+    Forward cumulative maximum limits descent, reverse one limits
+    climb, together they give the minimal profile within both limits.
+
+    :param target: (n, ) array of minimal altitudes
+    :param distance: (n, ) array of distances from line start
+    :param line: (n, ) array of line indices in ascending order
+    :param climb: maximal climb gradient (m per m)
+    :param descent: maximal descent gradient (m per m)
+    """
+    forward = _group_accumulate(target + descent * distance, line) - descent * distance
+    reverse = _group_accumulate((forward - climb * distance)[::-1], line.max(initial=0) - line[::-1])
+
+    return reverse[::-1] + climb * distance
+
+class AerogenDrape(object):
+    def __init__(self, dem, clearance, climb, descent, spacing=None):
+        """Terrain following altitude profiles along flight lines.
+
+        :param dem: AerogenDem
+        :param clearance: terrain clearance in meters
+        :param climb: maximal climb gradient (m per m)
+        :param descent: maximal descent gradient (m per m)
+        :param spacing: profile point spacing in meters, DEM is sampled
+        at line endpoints only if not given
+        """
+        if climb <= 0 or descent <= 0:
+            raise AerogenError("Climb and descent gradients must be positive")
+
+        self._dem = dem
+        self._clearance = clearance
+        self._climb = climb
+        self._descent = descent
+        self._spacing = spacing
+
+    def profiles(self, xy, crs, ids=None):
+        """Compute altitude profiles.
+
+        :param xy: corrected flight path as (n, 2) array in UTM, line k
+        is defined by points 2k and 2k+1 (see AerogenReader.line_array)
+        :param crs: CRS of the flight path
+        :param ids: line numbers, AerogenError is raised when their
+        number does not match number of lines
+
+        :return: dictionary of arrays (see PROFILE_COLUMNS)
+        """
+        line, distance, points = densify(np.asarray(xy, dtype=float), self._spacing)
+        dem_crs = self._dem.crs()
+        if dem_crs != crs_registry.crs(crs):
+            ground = self._dem.sample(transform_array(points, crs_registry.transform(crs, dem_crs)))
+        else:
+            ground = self._dem.sample(points)
+
+        missing = np.isnan(ground)
+        if missing.all():
+            raise AerogenError("Flight lines are outside of DEM")
+        if missing.any():
+            # gaps are interpolated along the flight path
+            index = np.arange(len(ground))
+            ground[missing] = np.interp(index[missing], index[~missing], ground[~missing])
+
+        altitude = limit_profile(ground + self._clearance, distance, line,
+                                 self._climb, self._descent)
+        count = len(xy) // 2
+        if ids is not None and len(ids) != count:
+            raise AerogenError("Number of line numbers ({}) does not match number of lines ({})".format(
+                len(ids), count))
+        try:
+            ids = np.asarray(ids).astype(np.int64)
+        except (TypeError, ValueError):
+            # no or not numeric line numbers
+            ids = np.arange(count, dtype=np.int64)
+
+        return {
+            'line': ids[line],
+            'distance': distance,
+            'x': points[:, 0],
+            'y': points[:, 1],
+            'ground': ground,
+            'altitude': altitude,
+        }
+
+    @staticmethod
+    def geometries(profiles, xform=None):
+        """Returns LineStringZM geometry of each line, Z holds altitude
+        and M distance from line start.
+
+        :param xform: optional QgsCoordinateTransform into output CRS
+        """
+        xy = np.column_stack((profiles['x'], profiles['y']))
+        if xform is not None:
+            xy = transform_array(xy, xform)
+        line = profiles['line']
+        starts = np.flatnonzero(np.append(True, line[1:] != line[:-1]))
+        stops = np.append(starts[1:], len(line))
+
+        return [polyline_geometry(xy[a:b], profiles['altitude'][a:b], profiles['distance'][a:b])
+                for a, b in zip(starts, stops)]
+
+    @staticmethod
+    def write_csv(filename, profiles):
+        """Write profiles into CSV sidecar table."""
+        parts = [format_fixed(profiles['line'], 0)]
+        for name, decimals in (('distance', 2), ('x', 2), ('y', 2), ('ground', 2), ('altitude', 2)):
+            parts += [b',', format_fixed(profiles[name], decimals)]
+        with open(filename, 'wb') as f:
+            f.write(','.join(PROFILE_COLUMNS).encode('ascii') + b'\n')
+            f.write(compose(parts + [b'\n'], len(profiles['line'])))
@@ -0,0 +1,239 @@
+import math
+
+import numpy as np
+
+from .exceptions import AerogenError
+
+# numbering offset (header 'offset SL', 'offset TL') and numbering step
+# used by the vendor software, the first line is numbered offset + step
+LINE_NUMBERING = {
+    'sl': (2000, 10),
+    'tl': (20000, 10),
+}
+
+# maximum number of (line, edge) pairs evaluated at once
+CLIP_CHUNK_SIZE = 2 ** 20
+
+def clip_lines(polygon, direction, offsets):
+    """Clip infinite parallel lines to the polygon.
+
+    Lines are given by unit direction vector and signed offsets along
+    the normal vector (direction rotated by 90 degrees clockwise).
+    Returns minimal and maximal along-line coordinate of the crossings
+    with polygon boundary for each line, NaN if the line misses the
+    polygon.
+    """
+    normal = np.array([direction[1], -direction[0]])
+    ring = np.vstack((polygon, polygon[:1]))
+    u = ring @ direction
+    v = ring @ normal
+    u1, u2 = u[:-1], u[1:]
+    v1, v2 = v[:-1], v[1:]
+    dv = v2 - v1
+    # horizontal edges (in rotated frame) never cross a line
+    dv[dv == 0] = np.nan
+
+    offsets = np.asarray(offsets, dtype=float)
+    umin = np.full(len(offsets), np.nan)
+    umax = np.full(len(offsets), np.nan)
+    step = max(1, CLIP_CHUNK_SIZE // len(u1))
+    for start in range(0, len(offsets), step):
+        vk = offsets[start:start + step, np.newaxis]
+        # half-open test so that vertex crossings are counted once
+        mask = (v1 <= vk) != (v2 <= vk)
+        t = (vk - v1) / dv
+        uk = u1 + t * (u2 - u1)
+        hit = mask.any(axis=1)
+        umin[start:start + step] = np.where(
+            hit, np.where(mask, uk, np.inf).min(axis=1), np.nan)
+        umax[start:start + step] = np.where(
+            hit, np.where(mask, uk, -np.inf).max(axis=1), np.nan)
+
+    return umin, umax
+
+def clip_segments(polygon, lines, lead=0.0):
+    """Clip flight lines to the polygon extended by run-in/run-out distance.
+
+    Each line is trimmed or extended along its own direction so that it
+    starts lead meters before its first crossing with polygon boundary
+    and ends lead meters after the last one. Candidate polygon edges of
+    each line are found by a sweep in the frame of the mean line
+    direction, so that only edges near the line are intersected.
+
+    :param polygon: area polygon vertices as (m, 2) array
+    :param lines: line endpoints as (n, 2, 2) array
+    :param lead: run-in/run-out distance in meters
+
+    :return: tuple of clipped lines as (n, 2, 2) array (lines missing
+    the polygon are kept unchanged) and boolean mask of lines crossing
+    the polygon
+    """
+    lines = np.asarray(lines, dtype=float)
+    a = lines[:, 0]
+    ab = lines[:, 1] - a
+    length = np.hypot(*ab.T)
+    valid = length > 0
+    # degenerated lines have no direction
+    direction = ab / np.where(valid, length, np.nan)[:, np.newaxis]
+    ring = np.vstack((polygon, polygon[:1]))
+    p, q = ring[:-1], ring[1:]
+
+    # reference frame given by mean direction (lines are flown both ways)
+    if valid.any():
+        first = direction[valid][0]
+        d0 = (direction[valid] * np.sign(direction[valid] @ first)[:, np.newaxis]).sum(axis=0)
+        d0 /= np.hypot(*d0)
+    else:
+        d0 = np.array([1.0, 0.0])
+    n0 = np.array([d0[1], -d0[0]])
+
+    # range of reference offsets covered by each line over polygon extent
+    ur = ring @ d0
+    cos = direction @ d0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s = (ur.min() - a @ d0)[:, np.newaxis], (ur.max() - a @ d0)[:, np.newaxis]
+        s = np.hstack(s) / cos[:, np.newaxis]
+        v = (a @ n0)[:, np.newaxis] + s * (direction @ n0)[:, np.newaxis]
+    lo, hi = v.min(axis=1), v.max(axis=1)
+    # lines close to perpendicular to reference direction need all edges
+    steep = ~(np.isfinite(lo) & np.isfinite(hi))
+    lo[steep], hi[steep] = -np.inf, np.inf
+
+    # edges sorted by minimal reference offset
+    vp, vq = p @ n0, q @ n0
+    vmin = np.minimum(vp, vq)
+    order = np.argsort(vmin)
+    vmin = vmin[order]
+    span = (np.maximum(vp, vq) - np.minimum(vp, vq)).max()
+    begin = np.searchsorted(vmin, lo - span)
+    counts = np.where(valid, np.searchsorted(vmin, hi, side='right') - begin, 0)
+
+    umin = np.full(len(lines), np.nan)
+    umax = np.full(len(lines), np.nan)
+    bounds = np.searchsorted(np.cumsum(counts), np.arange(0, counts.sum(), CLIP_CHUNK_SIZE))
+    for start, stop in zip(bounds, np.append(bounds[1:], len(lines))):
+        stop = max(stop, start + 1)
+        chunk_counts = counts[start:stop]
+        line = np.repeat(np.arange(start, stop), chunk_counts)
+        first_pair = np.cumsum(chunk_counts) - chunk_counts
+        edge = order[np.repeat(begin[start:stop] - first_pair, chunk_counts) + np.arange(chunk_counts.sum())]
+
+        pa = (p[edge] - a[line]).T
+        qa = (q[edge] - a[line]).T
+        dx, dy = direction[line].T
+        u1, v1 = pa[0] * dx + pa[1] * dy, pa[0] * dy - pa[1] * dx
+        u2, v2 = qa[0] * dx + qa[1] * dy, qa[0] * dy - qa[1] * dx
+        # half-open test so that vertex crossings are counted once
+        mask = (v1 <= 0) != (v2 <= 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            uk = u1 + v1 / (v1 - v2) * (u2 - u1)
+
+        nonempty = chunk_counts > 0
+        if not nonempty.any():
+            continue
+        idx = np.arange(start, stop)[nonempty]
+        umin[idx] = np.minimum.reduceat(np.where(mask, uk, np.inf), first_pair[nonempty])
+        umax[idx] = np.maximum.reduceat(np.where(mask, uk, -np.inf), first_pair[nonempty])
+
+    hit = np.isfinite(umin) & np.isfinite(umax)
+    clipped = lines.copy()
+    for i, u in enumerate((umin - lead, umax + lead)):
+        clipped[hit, i] = a[hit] + u[hit, np.newaxis] * direction[hit]
+
+    return clipped, hit
+
+class AerogenLineGenerator(object):
+    def __init__(self, polygon, heading, spacing, origin=None):
+        """Flight lines generator.
+
+        :param polygon: area polygon vertices as (n, 2) array in UTM
+        :param heading: line heading (azimuth) in radians
+        :param spacing: line spacing in meters
+        :param origin: point the line grid is anchored to, first
+        polygon vertex when not given
+        """
+        if len(polygon) < 3:
+            raise AerogenError("Unable to generate lines, area polygon not defined")
+        if heading is None or not spacing or spacing <= 0:
+            raise AerogenError("Unable to generate lines, heading or spacing not defined")
+
+        self._polygon = np.asarray(polygon, dtype=float)
+        self._direction = np.array([math.sin(heading), math.cos(heading)])
+        self._normal = np.array([self._direction[1], -self._direction[0]])
+        self._spacing = spacing
+        self._origin = np.asarray(
+            origin if origin is not None else self._polygon[0], dtype=float
+        )
+
+    def lines(self):
+        """Generate lines.
+
+        Returns line endpoints as (n, 2, 2) array ordered in the flight
+        direction (every other line is reversed).
+        """
+        v = self._polygon @ self._normal
+        v0 = self._origin @ self._normal
+        # lines are numbered from the left side of the heading
+        kmax = math.floor((v.max() - v0) / self._spacing)
+        kmin = math.ceil((v.min() - v0) / self._spacing)
+        offsets = v0 + np.arange(kmax, kmin - 1, -1) * self._spacing
+
+        umin, umax = clip_lines(self._polygon, self._direction, offsets)
+        valid = ~np.isnan(umin) & (umax > umin)
+        offsets, umin, umax = offsets[valid], umin[valid], umax[valid]
+
+        # the first line is flown against the heading
+        reverse = np.arange(len(offsets)) % 2 == 0
+        ustart = np.where(reverse, umax, umin)
+        uend = np.where(reverse, umin, umax)
+
+        lines = np.empty((len(offsets), 2, 2))
+        for i, u in enumerate((ustart, uend)):
+            lines[:, i] = u[:, np.newaxis] * self._direction + \
+                offsets[:, np.newaxis] * self._normal
+
+        return lines
+
+    @staticmethod
+    def line_ids(type, count, offset=None):
+        """Returns line numbers according to the vendor numbering scheme.
+
+        :param offset: numbering offset from header, default used if not given
+        """
+        default, step = LINE_NUMBERING[type]
+        if offset is None:
+            offset = default
+        return int(offset) + step * np.arange(1, count + 1)
+
+    @staticmethod
+    def write(filename, type, lines, lonlat, header, offset=None):
+        """Write lines in vendor's XYZ format.
+
+        :param lines: line endpoints in UTM as (n, 2, 2) array
+        :param lonlat: line endpoints in WGS84 as (n, 2, 2) array
+        :param header: list of (value, key) header items
+        :param offset: line numbering offset
+        """
+        ids = AerogenLineGenerator.line_ids(type, len(lines), offset)
+        lengths = np.hypot(*(lines[:, 1] - lines[:, 0]).T)
+        title = 'Survey Lines' if type == 'sl' else 'Tie Lines'
+        try:
+            with open(filename, 'w') as f:
+                for value, key in header:
+                    f.write('/ {}; {}\n'.format(value, key))
+                f.write('/ AeroGen\n')
+                f.write('/ Number of {}: {}\n'.format(title, len(lines)))
+                f.write('/\n')
+                f.write('/      Xcoor       Ycoor        Lon         Lat               Distance (M)\n')
+                f.write('/\n')
+                for lid, line, ll, length in zip(ids, lines, lonlat, lengths):
+                    f.write('Line     {}\n'.format(lid))
+                    f.write('    {:.2f}   {:.2f}   {:.6f}    {:.6f}     1         {:.2f}\n'.format(
+                        line[0][0], line[0][1], ll[0][0], ll[0][1], length))
+                    f.write('    {:.2f}   {:.2f}   {:.6f}    {:.6f}     2\n'.format(
+                        line[1][0], line[1][1], ll[1][0], ll[1][1]))
+                f.write('  \n')
+                f.write('                        {} total distance :       {:.3f} km\n'.format(
+                    title, lengths.sum() / 1000))
+        except IOError as e:
+            raise AerogenError(e)
@@ -0,0 +1,76 @@
+import struct
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QByteArray
+from qgis.core import QgsGeometry
+
+# ISO WKB geometry types
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_Z = 1000
+WKB_M = 2000
+
+def _coordinates(xy, z=None, m=None):
+    """Returns interleaved little-endian coordinates and WKB type offset."""
+    columns = [xy[:, 0], xy[:, 1]]
+    offset = 0
+    if z is not None:
+        columns.append(z)
+        offset += WKB_Z
+    if m is not None:
+        columns.append(m)
+        offset += WKB_M
+    if len(columns) == 2:
+        coords = np.ascontiguousarray(xy, dtype='<f8')
+    else:
+        coords = np.column_stack(columns).astype('<f8', copy=False)
+
+    return coords.tobytes(), offset
+
+def linestring_wkb(xy, z=None, m=None):
+    """Encode linestring as WKB.
+
+    :param xy: vertices as (n, 2) array
+    :param z: optional (n, ) array of Z values
+    :param m: optional (n, ) array of M values
+    """
+    coords, offset = _coordinates(xy, z, m)
+    return struct.pack('<BII', 1, WKB_LINESTRING + offset, len(xy)) + coords
+
+def polygon_wkb(xy):
+    """Encode polygon (exterior ring only) as WKB, ring is closed if needed."""
+    if len(xy) and not np.array_equal(xy[0], xy[-1]):
+        xy = np.vstack((xy, xy[:1]))
+    coords, offset = _coordinates(xy)
+    return struct.pack('<BIII', 1, WKB_POLYGON, 1, len(xy)) + coords
+
+def from_wkb(wkb):
+    geom = QgsGeometry()
+    geom.fromWkb(QByteArray(wkb))
+    return geom
+
+def polyline_geometry(xy, z=None, m=None):
+    """Build linestring geometry from coordinate arrays."""
+    return from_wkb(linestring_wkb(xy, z, m))
+
+def polygon_geometry(xy):
+    """Build polygon geometry from array of vertices."""
+    return from_wkb(polygon_wkb(xy))
+
+def linestring_array(geom):
+    """Returns vertices of 2D linestring geometry as (n, 2) array."""
+    wkb = bytes(geom.asWkb())
+    # skip byte order, type and number of points
+    return np.frombuffer(wkb, dtype='<f8', offset=9).reshape(-1, 2).copy()
+
+def transform_array(xy, xform):
+    """Transform (n, 2) array of coordinates in one call."""
+    if len(xy) == 0:
+        return np.empty((0, 2))
+    if len(xy) == 1:
+        # linestring requires at least two vertices
+        return transform_array(np.vstack((xy, xy)), xform)[:1]
+    geom = polyline_geometry(xy)
+    geom.transform(xform)
+    return linestring_array(geom)
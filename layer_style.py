@@ -0,0 +1,89 @@
+from qgis.PyQt.QtXml import QDomDocument
+from qgis.core import QgsWkbTypes, QgsRuleBasedRenderer, QgsSingleSymbolRenderer, \
+    QgsLineSymbol, QgsMarkerSymbol, QgsMarkerLineSymbolLayer, QgsPalLayerSettings, \
+    QgsVectorLayerSimpleLabeling, QgsVectorSimplifyMethod, QgsUnitTypes
+
+from .exceptions import AerogenError
+
+# simplification threshold in pixels
+SIMPLIFY_THRESHOLD = 1.0
+# direction arrows and labels are drawn only at larger scales than 1:DETAIL_SCALE
+DETAIL_SCALE = 100000
+# attributes used for labels, first found is used
+LABEL_FIELDS = ('line', 'survey')
+
+def apply_style(layer, filename, detail_scale=DETAIL_SCALE):
+    """Apply style with render optimizations.
+
+    Style is loaded only once, geometry simplification (provider-side
+    if supported, render-side otherwise) is set directly in the style
+    document. Line layers get rule-based symbology with direction
+    arrows shown only above detail scale, labels are scale dependent
+    as well.
+    """
+    doc = QDomDocument()
+    try:
+        with open(filename) as f:
+            ok, message, line, column = doc.setContent(f.read())
+        if not ok:
+            raise AerogenError("Invalid style {} (line {}, column {}): {}".format(
+                filename, line, column, message))
+    except IOError as e:
+        raise AerogenError(e)
+
+    root = doc.documentElement()
+    root.setAttribute('simplifyDrawingHints', str(int(QgsVectorSimplifyMethod.FullSimplification)))
+    root.setAttribute('simplifyAlgorithm', str(int(QgsVectorSimplifyMethod.Distance)))
+    root.setAttribute('simplifyDrawingTol', str(SIMPLIFY_THRESHOLD))
+    # let provider simplify geometries when possible
+    root.setAttribute('simplifyLocal', '0')
+    root.setAttribute('simplifyMaxScale', '1')
+
+    ok, message = layer.importNamedStyle(doc)
+    if not ok:
+        raise AerogenError(message)
+
+    if layer.geometryType() == QgsWkbTypes.LineGeometry:
+        _set_rules(layer, detail_scale)
+    _set_labels(layer, detail_scale)
+
+def _set_rules(layer, detail_scale):
+    """Wrap line symbol into rules, add direction arrows at detail scales."""
+    if not isinstance(layer.renderer(), QgsSingleSymbolRenderer):
+        return
+    symbol = layer.renderer().symbol()
+
+    root = QgsRuleBasedRenderer.Rule(None)
+    root.appendChild(QgsRuleBasedRenderer.Rule(symbol.clone(), label='line'))
+
+    marker = QgsMarkerSymbol.createSimple({
+        'name': 'arrowhead',
+        'size': '2',
+        'color': symbol.color().name(),
+        'outline_color': symbol.color().name(),
+    })
+    arrows = QgsMarkerLineSymbolLayer(True, 20)
+    arrows.setIntervalUnit(QgsUnitTypes.RenderMillimeters)
+    arrows.setSubSymbol(marker)
+    # minimum scale is the most zoomed out scale
+    root.appendChild(QgsRuleBasedRenderer.Rule(
+        QgsLineSymbol([arrows]), 0, detail_scale, label='direction'
+    ))
+
+    layer.setRenderer(QgsRuleBasedRenderer(root))
+
+def _set_labels(layer, detail_scale):
+    names = layer.fields().names()
+    fields = [name for name in LABEL_FIELDS if name in names]
+    if not fields:
+        return
+
+    settings = QgsPalLayerSettings()
+    settings.fieldName = fields[0]
+    if layer.geometryType() == QgsWkbTypes.LineGeometry:
+        settings.placement = QgsPalLayerSettings.Line
+    settings.scaleVisibility = True
+    settings.minimumScale = detail_scale
+    settings.maximumScale = 0
+    layer.setLabeling(QgsVectorLayerSimpleLabeling(settings))
+    layer.setLabelsEnabled(True)
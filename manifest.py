@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+MANIFEST_FILE = '.aerogen_manifest.json'
+
+def file_hash(path, opener=open):
+    """Returns SHA-256 hash of file content."""
+    sha = hashlib.sha256()
+    with opener(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+class AerogenManifest(object):
+    def __init__(self, output_dir, opener=None):
+        """Build manifest stored in output directory.
+
+        For each product records hashes of its input files, settings
+        used and hashes of written files, so that up-to-date products
+        don't need to be generated again. Written files are hashed again
+        only when their size or modification time changed.
+
+        :param output_dir: output directory
+        :param opener: function used to open input files
+        """
+        self._filename = os.path.join(output_dir, MANIFEST_FILE)
+        self._open = opener or open
+        try:
+            with open(self._filename) as f:
+                self._products = json.load(f)
+        except (IOError, ValueError):
+            # missing or corrupted manifest, rebuild everything
+            self._products = {}
+
+    def up_to_date(self, product, inputs, settings):
+        """Check if product outputs are up to date.
+
+        :param product: product key
+        :param inputs: list of input files
+        :param settings: dictionary of settings affecting outputs
+        """
+        entry = self._products.get(product)
+        if not entry or entry['settings'] != settings:
+            return False
+        try:
+            if entry['inputs'] != self._hashes(inputs, self._open):
+                return False
+            return self._outputs_up_to_date(entry['outputs'])
+        except (IOError, OSError):
+            # input or output file missing
+            return False
+
+    def update(self, product, inputs, settings, outputs):
+        """Record product build.
+
+        :param outputs: list of written files
+        """
+        self._products[product] = {
+            'inputs': self._hashes(inputs, self._open),
+            'settings': settings,
+            'outputs': self._outputs(outputs),
+        }
+
+    def invalidate(self, product):
+        self._products.pop(product, None)
+
+    def save(self):
+        with open(self._filename, 'w') as f:
+            json.dump(self._products, f, indent=2, sort_keys=True)
+
+    @staticmethod
+    def outputs(output_dir, name):
+        """Returns files written for output name (all extensions)."""
+        prefix = name + '.'
+        return [os.path.join(output_dir, filename) for filename in os.listdir(output_dir)
+                if filename.startswith(prefix)]
+
+    @staticmethod
+    def _outputs(paths):
+        """Returns hash, size and modification time of written files."""
+        result = {}
+        for path in paths:
+            stat = os.stat(path)
+            result[os.path.normpath(path)] = {
+                'hash': file_hash(path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+            }
+
+        return result
+
+    @staticmethod
+    def _outputs_up_to_date(outputs):
+        """Check written files, only files with changed size or
+        modification time are hashed."""
+        for path, recorded in outputs.items():
+            stat = os.stat(path)
+            if not isinstance(recorded, dict):
+                # manifest written by older version, hash only
+                recorded = {'hash': recorded, 'size': None, 'mtime': None}
+            elif recorded['size'] == stat.st_size and recorded['mtime'] == stat.st_mtime_ns:
+                continue
+            if file_hash(path) != recorded['hash']:
+                return False
+            # content not changed, file was touched only
+            outputs[path] = {'hash': recorded['hash'], 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+        return True
+
+    @staticmethod
+    def _hashes(paths, opener=open):
+        return {os.path.normpath(path): file_hash(path, opener) for path in paths}
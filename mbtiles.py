@@ -0,0 +1,188 @@
+import os
+import math
+import shutil
+import sqlite3
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from qgis import core as qgis_core
+from qgis.core import QgsVectorLayer, QgsFeature, QgsProject, QgsRectangle, QgsWkbTypes
+
+from .exceptions import AerogenError
+from . import crs_registry
+
+# web mercator tile size (meters) at zoom level 0
+TILE_SIZE_0 = 2 * math.pi * 6378137
+# simplification tolerance in tile pixels (256 pixels per tile)
+SIMPLIFY_PIXELS = 0.5
+MIN_ZOOM = 0
+MAX_ZOOM = 14
+
+def simplify_tolerance(zoom):
+    """Returns simplification tolerance in meters for zoom level."""
+    return TILE_SIZE_0 / (256 * 2 ** zoom) * SIMPLIFY_PIXELS
+
+def _features(layer):
+    """Returns attributes and Web Mercator geometries of layer features."""
+    xform = crs_registry.transform(layer.crs(), 'EPSG:3857')
+    features = []
+    for feature in layer.getFeatures():
+        geom = feature.geometry()
+        geom.transform(xform)
+        features.append((feature.attributes(), geom))
+
+    return features
+
+def _simplify(features, zoom):
+    """Simplify geometries for zoom level."""
+    tolerance = simplify_tolerance(zoom)
+    result = []
+    for attributes, geom in features:
+        simplified = geom.simplify(tolerance)
+        result.append((attributes, geom if simplified.isEmpty() else simplified))
+
+    return result
+
+def _memory_layer(layer, features):
+    """Returns memory layer with given features and fields of the layer."""
+    result = QgsVectorLayer('{}?crs=EPSG:3857'.format(QgsWkbTypes.displayString(layer.wkbType())),
+                            layer.name(), 'memory')
+    provider = result.dataProvider()
+    provider.addAttributes(layer.fields().toList())
+    result.updateFields()
+    copies = []
+    for attributes, geom in features:
+        copy = QgsFeature(result.fields())
+        copy.setAttributes(attributes)
+        copy.setGeometry(geom)
+        copies.append(copy)
+    provider.addFeatures(copies)
+    result.updateExtents()
+
+    return result
+
+def _extent(features):
+    """Returns combined bounding box of features."""
+    extent = QgsRectangle()
+    for layer_features in features:
+        for __, geom in layer_features:
+            extent.combineExtentWith(geom.boundingBox())
+
+    return extent
+
+def _tile_extents(extent, zoom, count):
+    """Split extent into at most count strips of whole tile columns at
+    zoom level, strips do not share any tile."""
+    size = TILE_SIZE_0 / 2 ** zoom
+    origin = -TILE_SIZE_0 / 2
+    first = int(math.floor((extent.xMinimum() - origin) / size))
+    columns = int(math.floor((extent.xMaximum() - origin) / size)) - first + 1
+    count = max(1, min(count, columns))
+    # keep strip inside its columns
+    margin = size * 1e-6
+    extents = []
+    for k in range(count):
+        start = first + columns * k // count
+        stop = first + columns * (k + 1) // count
+        extents.append(QgsRectangle(max(origin + start * size + margin, extent.xMinimum()),
+                                    extent.yMinimum(),
+                                    min(origin + stop * size - margin, extent.xMaximum()),
+                                    extent.yMaximum()))
+
+    return extents
+
+def _write_part(layers, features, zoom, extent, filename):
+    """Write tiles of zoom level in extent by separate writer run."""
+    # features in tile buffer of the strip are needed too
+    buffered = extent.buffered(TILE_SIZE_0 / 2 ** zoom)
+    # simplified copies must stay alive while writing
+    copies = []
+    tile_layers = []
+    for layer, layer_features in zip(layers, features):
+        selected = [(attributes, geom) for attributes, geom in layer_features
+                    if geom.boundingBox().intersects(buffered)]
+        copies.append(_memory_layer(layer, _simplify(selected, zoom)))
+        tile_layer = qgis_core.QgsVectorTileWriter.Layer(copies[-1])
+        tile_layer.setLayerName(layer.name())
+        tile_layers.append(tile_layer)
+
+    writer = qgis_core.QgsVectorTileWriter()
+    writer.setDestinationUri('type=mbtiles&url={}'.format(filename))
+    writer.setMinZoom(zoom)
+    writer.setMaxZoom(zoom)
+    writer.setExtent(extent)
+    writer.setTransformContext(QgsProject.instance().transformContext())
+    writer.setLayers(tile_layers)
+    writer.setMetadata({'name': ', '.join(layer.name() for layer in layers)})
+    if not writer.writeTiles():
+        raise AerogenError(writer.errorMessage())
+
+def _merge(filename, parts, extent, min_zoom, max_zoom):
+    """Merge tiles of MBTiles parts into the first one and move it to filename."""
+    db = sqlite3.connect(parts[0])
+    try:
+        for part in parts[1:]:
+            db.execute('ATTACH DATABASE ? AS part', (part,))
+            # tiles in tile buffer may be written by both neighbour strips
+            db.execute('INSERT OR REPLACE INTO tiles SELECT * FROM part.tiles')
+            db.commit()
+            db.execute('DETACH DATABASE part')
+        bounds = crs_registry.transform('EPSG:3857', 'EPSG:4326').transformBoundingBox(extent)
+        db.executemany('UPDATE metadata SET value = ? WHERE name = ?', (
+            (str(min_zoom), 'minzoom'),
+            (str(max_zoom), 'maxzoom'),
+            ('{},{},{},{}'.format(bounds.xMinimum(), bounds.yMinimum(),
+                                  bounds.xMaximum(), bounds.yMaximum()), 'bounds'),
+        ))
+        db.commit()
+    finally:
+        db.close()
+    if os.path.exists(filename):
+        os.remove(filename)
+    shutil.move(parts[0], filename)
+
+def export_mbtiles(layers, filename, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM,
+                   workers=None, feedback=None):
+    """Export layers into MBTiles vector tile pyramid.
+
+    Each zoom level is written from copies of the layers simplified with
+    tolerance of half a pixel at that level. Zoom levels are split into
+    strips of tile columns written concurrently by separate writer runs
+    into temporary MBTiles files (tile writer does not hold the GIL),
+    which are merged afterwards. Only copies of running writers are
+    kept in memory.
+
+    :param layers: list of vector layers (polygon, survey lines, tie lines)
+    :param filename: output MBTiles file
+    :param workers: number of concurrent writer runs, number of CPUs if not given
+    :param feedback: optional QgsFeedback for progress and cancellation
+    """
+    if not hasattr(qgis_core, 'QgsVectorTileWriter'):
+        raise AerogenError("MBTiles export requires QGIS 3.14 or later")
+
+    workers = workers or os.cpu_count() or 1
+    features = [_features(layer) for layer in layers]
+    extent = _extent(features)
+    if extent.isNull():
+        raise AerogenError("No features to export")
+    jobs = [(zoom, part_extent) for zoom in range(min_zoom, max_zoom + 1)
+            for part_extent in _tile_extents(extent, zoom, workers)]
+
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        parts = [os.path.join(tmp_dir, '{}.mbtiles'.format(k)) for k in range(len(jobs))]
+
+        def write(k):
+            if feedback is None or not feedback.isCanceled():
+                _write_part(layers, features, jobs[k][0], jobs[k][1], parts[k])
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for done, __ in enumerate(executor.map(write, range(len(jobs))), 1):
+                if feedback is not None:
+                    feedback.setProgress(100.0 * done / len(jobs))
+        if feedback is not None and feedback.isCanceled():
+            raise AerogenError("MBTiles export canceled")
+
+        _merge(filename, parts, extent, min_zoom, max_zoom)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
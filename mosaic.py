@@ -0,0 +1,102 @@
+import os
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsField, QgsFields, QgsFeature, QgsSpatialIndex
+
+from .reader import AerogenReader, AerogenReaderError, main_xyz_file
+from . import crs_registry
+
+class AerogenMosaic(object):
+    def __init__(self, directories, generate_lines=False):
+        """Mosaic of adjacent surveys.
+
+        :param directories: list of survey directories
+        :param generate_lines: generate lines from area polygons
+        """
+        self._readers = []
+        self._names = []
+        for directory in directories:
+            filename = main_xyz_file(directory)
+            if filename is None:
+                # not a survey directory
+                continue
+            reader = AerogenReader(os.path.join(directory, filename))
+            reader.set_generate_lines(generate_lines)
+            self._readers.append(reader)
+            self._names.append(os.path.basename(os.path.normpath(directory)))
+
+        if not self._readers:
+            raise AerogenReaderError("No surveys found")
+
+        # polygons are transformed into CRS of the first survey
+        self._crs = crs_registry.crs(self._readers[0].crs())
+
+    @staticmethod
+    def directories(path):
+        """Returns survey directories found in path."""
+        return [os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.isdir(os.path.join(path, name))]
+
+    def crs(self):
+        return self._crs
+
+    def surveys(self):
+        return self._names
+
+    def fields(self):
+        """Returns fields with source survey attribute."""
+        fields = QgsFields()
+        fields.append(QgsField('survey', QVariant.String))
+        return fields
+
+    def attributes(self):
+        return [[name] for name in self._names]
+
+    def area(self, crs=None):
+        """Returns area polygons in CRS, CRS of the first survey if not given."""
+        crs = self._crs if crs is None else crs
+        return [reader.area(crs)[0] for reader in self._readers]
+
+    def sl(self, crs=4326):
+        return [reader.sl(crs)[0] for reader in self._readers]
+
+    def tl(self, crs=4326):
+        return [reader.tl(crs)[0] for reader in self._readers]
+
+    def check(self, polygons, tolerance=100):
+        """Detect overlaps and gaps between survey polygons.
+
+        Candidate pairs are taken from R-tree index of polygon bounding
+        boxes instead of testing each pair of surveys.
+
+        :param polygons: survey polygons as returned by area()
+        :param tolerance: maximal distance of adjacent surveys
+        considered as gap (in map units)
+
+        :return: tuple of overlaps and gaps, each item as (survey1, survey2, geometry)
+        """
+        index = QgsSpatialIndex()
+        for fid, geom in enumerate(polygons):
+            feature = QgsFeature(fid)
+            feature.setGeometry(geom)
+            index.addFeature(feature)
+
+        overlaps = []
+        gaps = []
+        for i, geom in enumerate(polygons):
+            bbox = geom.boundingBox().buffered(tolerance)
+            for j in index.intersects(bbox):
+                if j <= i:
+                    # each pair only once
+                    continue
+                other = polygons[j]
+                if geom.intersects(other):
+                    intersection = geom.intersection(other)
+                    if intersection.area() > 0:
+                        overlaps.append((self._names[i], self._names[j], intersection))
+                else:
+                    distance = geom.distance(other)
+                    if distance <= tolerance:
+                        gaps.append((self._names[i], self._names[j], geom.shortestLine(other)))
+
+        return overlaps, gaps
@@ -0,0 +1,25 @@
+import collections
+from concurrent.futures import ProcessPoolExecutor
+
+def map_ordered(fn, tasks, workers):
+    """Map function over tasks in order, optionally in process pool.
+
+    At most two tasks per worker are in flight, so that memory stays
+    bounded regardless of number of tasks.
+
+    :param fn: module level function, so that it can be run in worker processes
+    :param workers: number of worker processes, 0 to run in the current process
+    """
+    if not workers:
+        for task in tasks:
+            yield fn(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(executor.submit(fn, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
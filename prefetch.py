@@ -0,0 +1,180 @@
+import io
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# default size limit of local cache directory in bytes
+CACHE_SIZE = 1024 ** 3
+
+class AerogenPrefetcher(object):
+    def __init__(self, directory, cache_dir=None, workers=8, latency=0,
+                 cache_size=CACHE_SIZE):
+        """Concurrent reader of survey input files.
+
+        All XYZ files of the survey are fetched at once by a thread pool
+        and kept in memory, parsers then read from buffers instead of
+        opening the files one after another. Useful on network mounts
+        where each open costs tens of milliseconds.
+
+        Buffered files are served without accessing the directory,
+        refresh() fetches again files changed since they were fetched.
+
+        :param directory: survey directory
+        :param cache_dir: local read-through cache directory, no cache if None
+        :param workers: number of threads
+        :param latency: artificial latency (in seconds) added to each
+        file access, for testing only
+        :param cache_size: size limit of cache directory in bytes, least
+        recently used files are evicted
+        """
+        self._directory = directory
+        self._cache_dir = cache_dir
+        self._workers = workers
+        self._latency = latency
+        self._cache_size = cache_size
+        # (size, modification time) and data by file name
+        self._buffers = {}
+        self._lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+
+    def fetch(self, filenames=None):
+        """Fetch files concurrently.
+
+        :param filenames: list of file names, all XYZ files in the
+        directory if not given
+        """
+        if filenames is None:
+            filenames = [filename for filename in os.listdir(self._directory)
+                         if filename.endswith('.xyz')]
+        if not filenames:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(filenames))) as executor:
+            for filename, item in zip(filenames, executor.map(self._read, filenames)):
+                with self._lock:
+                    self._buffers[filename] = item
+
+    def refresh(self):
+        """Fetch again buffered files changed since they were fetched,
+        files removed meanwhile are dropped.
+
+        :return: list of changed file names
+        """
+        with self._lock:
+            buffers = dict(self._buffers)
+        if not buffers:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(buffers))) as executor:
+            stats = dict(zip(buffers, executor.map(self._stat, buffers)))
+        changed = [filename for filename in buffers if stats[filename] != buffers[filename][0]]
+        removed = [filename for filename in changed if stats[filename] is None]
+        for filename in removed:
+            self.invalidate(filename)
+        self.fetch([filename for filename in changed if filename not in removed])
+
+        return changed
+
+    def invalidate(self, filename=None):
+        """Drop buffered file (all files if not given)."""
+        with self._lock:
+            if filename is None:
+                self._buffers.clear()
+            else:
+                self._buffers.pop(os.path.basename(filename), None)
+
+    def open(self, path, mode='r'):
+        """Open buffered file, file is fetched when not buffered yet
+        (see refresh() and invalidate()).
+
+        Can be passed to AerogenReader as opener.
+        """
+        filename = os.path.basename(path)
+        with self._lock:
+            item = self._buffers.get(filename)
+        if item is None:
+            item = self._read(filename)
+            with self._lock:
+                self._buffers[filename] = item
+        data = item[1]
+
+        if 'b' in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode('utf-8', errors='replace'))
+
+    def _stat(self, filename):
+        """Returns (size, modification time) of file or None if missing."""
+        self._wait()
+        try:
+            stat = os.stat(os.path.join(self._directory, filename))
+        except (IOError, OSError):
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _read(self, filename):
+        """Read file, through local cache if enabled.
+
+        :return: tuple of (size, modification time) and data
+        """
+        path = os.path.join(self._directory, filename)
+        self._wait()
+        stat = os.stat(path)
+        key = (stat.st_size, stat.st_mtime_ns)
+        if self._cache_dir is None:
+            with open(path, 'rb') as f:
+                return key, f.read()
+
+        # cache key changes with file modification
+        digest = hashlib.sha1(
+            '{}:{}:{}'.format(os.path.abspath(path), *key).encode('utf-8')
+        ).hexdigest()
+        cache_file = os.path.join(self._cache_dir, digest)
+        try:
+            with open(cache_file, 'rb') as f:
+                data = f.read()
+            # mark as recently used
+            os.utime(cache_file)
+            return key, data
+        except (IOError, OSError):
+            pass
+
+        self._wait()
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.makedirs(self._cache_dir, exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, threading.get_ident())
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, cache_file)
+        self._evict()
+
+        return key, data
+
+    def _evict(self):
+        """Remove least recently used files till cache directory fits
+        into size limit."""
+        with self._cache_lock:
+            entries = []
+            for entry in os.scandir(self._cache_dir):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except (IOError, OSError):
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            total = sum(entry[1] for entry in entries)
+            for __, size, path in sorted(entries):
+                if total <= self._cache_size:
+                    break
+                try:
+                    os.remove(path)
+                except (IOError, OSError):
+                    continue
+                total -= size
+
+    def _wait(self):
+        if self._latency:
+            time.sleep(self._latency)
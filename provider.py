@@ -0,0 +1,389 @@
+import threading
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsVectorDataProvider, QgsAbstractFeatureSource, QgsAbstractFeatureIterator, \
+    QgsFeature, QgsFeatureIterator, QgsFeatureRequest, QgsFields, QgsField, QgsGeometry, QgsRectangle, \
+    QgsCoordinateTransform, QgsCsException, QgsDataProvider, QgsProviderMetadata, \
+    QgsProviderRegistry, QgsProject, QgsWkbTypes
+
+from .geometry import polyline_geometry, polygon_geometry, transform_array
+from .exceptions import AerogenError
+from . import crs_registry
+
+PROVIDER_KEY = 'aerogen'
+PROVIDER_DESCRIPTION = 'AeroGen survey'
+
+# number of children of spatial index node
+NODE_SIZE = 16
+
+_lock = threading.RLock()
+# datasets by layer URI
+_datasets = {}
+# provider metadata must outlive the registry
+_metadata = None
+
+def register_provider():
+    """Register data provider in QGIS, called once by the plugin."""
+    global _metadata
+    registry = QgsProviderRegistry.instance()
+    if PROVIDER_KEY not in registry.providerList():
+        _metadata = QgsProviderMetadata(PROVIDER_KEY, PROVIDER_DESCRIPTION, AerogenProvider.createProvider)
+        registry.registerProvider(_metadata)
+    QgsProject.instance().layersWillBeRemoved.connect(_layers_removed)
+
+def unregister_provider():
+    """Drop all datasets, called on plugin unload.
+
+    Provider stays registered in QGIS, its layers become invalid.
+    """
+    QgsProject.instance().layersWillBeRemoved.disconnect(_layers_removed)
+    with _lock:
+        _datasets.clear()
+
+def _layers_removed(layer_ids):
+    """Unregister datasets of layers being removed from project unless
+    used by other layers."""
+    removed = set(layer_ids)
+    uris = set()
+    used = set()
+    for layer_id, layer in QgsProject.instance().mapLayers().items():
+        if layer.providerType() == PROVIDER_KEY:
+            (uris if layer_id in removed else used).add(layer.source())
+    for uri in uris - used:
+        unregister(uri)
+
+def register(uri, dataset):
+    """Make dataset available to layers of the provider under URI.
+
+    Datasets live in memory only, layers of the provider saved in
+    project are invalid when the project is opened again.
+    """
+    with _lock:
+        _datasets[uri] = dataset
+
+def unregister(uri):
+    with _lock:
+        _datasets.pop(uri, None)
+
+def dataset(uri):
+    """Returns dataset registered under URI or None."""
+    with _lock:
+        return _datasets.get(uri)
+
+def _morton(xy):
+    """Returns Z-order codes of points as (n, ) array."""
+    low, high = xy.min(axis=0), xy.max(axis=0)
+    cells = ((xy - low) / np.where(high > low, high - low, 1) * 0xffff).astype(np.uint64)
+    for shift, mask in ((8, 0x00ff00ff), (4, 0x0f0f0f0f), (2, 0x33333333), (1, 0x55555555)):
+        cells = (cells | (cells << np.uint64(shift))) & np.uint64(mask)
+    return cells[:, 0] | (cells[:, 1] << np.uint64(1))
+
+class AerogenBoxIndex(object):
+    def __init__(self, boxes):
+        """Packed R-tree of bounding boxes.
+
+        Boxes are sorted by Z-order of their centers and grouped by
+        NODE_SIZE into nodes of the upper level till a single root.
+
+        :param boxes: (n, 4) array of xmin, ymin, xmax, ymax
+        """
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self._order = np.argsort(_morton((boxes[:, :2] + boxes[:, 2:]) / 2), kind='stable') \
+            if len(boxes) else np.empty(0, dtype=np.int64)
+        self._levels = [boxes[self._order]]
+        while len(self._levels[-1]) > 1:
+            level = self._levels[-1]
+            groups = np.arange(0, len(level), NODE_SIZE)
+            self._levels.append(np.hstack((np.minimum.reduceat(level[:, :2], groups),
+                                           np.maximum.reduceat(level[:, 2:], groups))))
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """Returns indices of boxes intersecting the rectangle in ascending order."""
+        nodes = np.arange(len(self._levels[-1]))
+        for depth in range(len(self._levels) - 1, -1, -1):
+            boxes = self._levels[depth][nodes]
+            nodes = nodes[(boxes[:, 0] <= xmax) & (boxes[:, 1] <= ymax) &
+                          (boxes[:, 2] >= xmin) & (boxes[:, 3] >= ymin)]
+            if depth:
+                children = (nodes[:, np.newaxis] * NODE_SIZE + np.arange(NODE_SIZE)).ravel()
+                nodes = children[children < len(self._levels[depth - 1])]
+
+        return np.sort(self._order[nodes])
+
+class AerogenDataset(object):
+    def __init__(self, xy, offsets, crs, polygon=False, m=None, fields=None, attributes=None):
+        """Features stored as coordinate arrays.
+
+        :param xy: vertices of all features as (n, 2) array
+        :param offsets: first vertex of each feature followed by number of vertices
+        :param crs: CRS of coordinates
+        :param polygon: features are polygons (exterior ring), linestrings otherwise
+        :param m: optional (n, ) array of M values
+        :param fields: optional QgsFields
+        :param attributes: list of attribute values for each feature
+        """
+        self.xy = np.asarray(xy, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.crs = crs_registry.crs(crs)
+        self.polygon = polygon
+        self.m = m
+        self.fields = fields or QgsFields()
+        self.attributes = attributes or [[] for _ in range(self.count())]
+
+        starts = self.offsets[:-1]
+        if self.count():
+            self.boxes = np.hstack((np.minimum.reduceat(self.xy, starts), np.maximum.reduceat(self.xy, starts)))
+        else:
+            self.boxes = np.empty((0, 4))
+        self.index = AerogenBoxIndex(self.boxes)
+
+    def count(self):
+        return len(self.offsets) - 1
+
+    def wkb_type(self):
+        if self.polygon:
+            return QgsWkbTypes.Polygon
+        return QgsWkbTypes.LineString if self.m is None else QgsWkbTypes.LineStringM
+
+    def extent(self):
+        if not self.count():
+            return QgsRectangle()
+        return QgsRectangle(*np.concatenate((self.boxes[:, :2].min(axis=0), self.boxes[:, 2:].max(axis=0))))
+
+    def geometry(self, feature):
+        a, b = self.offsets[feature], self.offsets[feature + 1]
+        if self.polygon:
+            return polygon_geometry(self.xy[a:b])
+        return polyline_geometry(self.xy[a:b], None, None if self.m is None else self.m[a:b])
+
+    def changed(self, geometries):
+        """Returns copy of dataset with changed geometries.
+
+        Only vertices of linestrings can be moved, so that arrays keep
+        their layout.
+
+        :param geometries: dictionary of geometries by feature id
+        """
+        if self.polygon:
+            raise AerogenError("Area polygon can not be edited")
+        xy = self.xy.copy()
+        m = None if self.m is None else self.m.copy()
+        for feature, geom in geometries.items():
+            if feature < 0 or feature >= self.count():
+                raise AerogenError("Feature {} does not exist".format(feature))
+            a, b = self.offsets[feature], self.offsets[feature + 1]
+            vertices = list(geom.vertices())
+            if len(vertices) != b - a:
+                raise AerogenError("Only vertices of flight lines can be moved")
+            xy[a:b] = [(v.x(), v.y()) for v in vertices]
+            if m is not None and QgsWkbTypes.hasM(geom.wkbType()):
+                m[a:b] = [v.m() for v in vertices]
+
+        return AerogenDataset(xy, self.offsets, self.crs, self.polygon, m, self.fields, self.attributes)
+
+def area_dataset(reader, crs=None):
+    """Area polygon of the survey (see AerogenReader.area).
+
+    :param crs: output CRS, survey UTM zone if not given
+    """
+    xy = reader.polygon()
+    if len(xy) < 3:
+        raise AerogenError("Unable to generate polygon geometry")
+    if crs is None:
+        crs = reader.crs()
+    if crs_registry.crs(crs) != crs_registry.crs(reader.crs()):
+        xy = transform_array(xy, crs_registry.transform(reader.crs(), crs))
+
+    return AerogenDataset(xy, [0, len(xy)], crs, polygon=True)
+
+def lines_dataset(reader, type, crs=None):
+    """Flight lines with line numbers, M holds distance from line start
+    (see AerogenReader.line_geometries).
+
+    :param crs: output CRS, survey UTM zone if not given
+    """
+    xy = reader.line_array(type)
+    count = len(xy) // 2
+    xy = xy[:2 * count]
+    m = np.zeros(len(xy))
+    m[1::2] = np.hypot(*(xy[1::2] - xy[0::2]).T)
+    if crs is None:
+        crs = reader.crs()
+    if crs_registry.crs(crs) != crs_registry.crs(reader.crs()):
+        xy = transform_array(xy, crs_registry.transform(reader.crs(), crs))
+
+    fields = QgsFields()
+    fields.append(QgsField('line', QVariant.String))
+    ids = reader.line_ids(type)
+    if len(ids) != count:
+        raise AerogenError("Number of line numbers ({}) does not match number of lines ({})".format(
+            len(ids), count))
+
+    return AerogenDataset(xy, np.arange(0, 2 * count + 1, 2), crs, m=m, fields=fields,
+                          attributes=[[str(line_id)] for line_id in ids])
+
+class AerogenFeatureIterator(QgsAbstractFeatureIterator):
+    def __init__(self, source, request):
+        """Iterator over features of dataset, only features in filter
+        rectangle are read using the spatial index."""
+        super(AerogenFeatureIterator, self).__init__(request)
+        self._request = request if request is not None else QgsFeatureRequest()
+        self._dataset = source.dataset
+        self._transform = QgsCoordinateTransform()
+        destination = self._request.destinationCrs()
+        if destination.isValid() and destination != self._dataset.crs:
+            self._transform = QgsCoordinateTransform(self._dataset.crs, destination,
+                                                     self._request.transformContext())
+        self._rect = None
+        try:
+            self._features = self._candidates()
+        except QgsCsException:
+            self._features = np.empty(0, dtype=np.int64)
+        self._position = 0
+
+    def _candidates(self):
+        rect = self.filterRectToSourceCrs(self._transform)
+        if rect.isNull():
+            features = np.arange(self._dataset.count())
+        else:
+            features = self._dataset.index.query(rect.xMinimum(), rect.yMinimum(),
+                                                 rect.xMaximum(), rect.yMaximum())
+            if self._request.flags() & QgsFeatureRequest.ExactIntersect:
+                self._rect = QgsGeometry.fromRect(rect)
+
+        filter_type = self._request.filterType()
+        if filter_type == QgsFeatureRequest.FilterFid:
+            features = np.intersect1d(features, [self._request.filterFid()])
+        elif filter_type == QgsFeatureRequest.FilterFids:
+            features = np.intersect1d(features, np.fromiter(self._request.filterFids(), dtype=np.int64))
+
+        return features
+
+    def fetchFeature(self, f):
+        while 0 <= self._position < len(self._features):
+            feature = int(self._features[self._position])
+            self._position += 1
+            geometry = None
+            if self._rect is not None:
+                geometry = self._dataset.geometry(feature)
+                if not geometry.intersects(self._rect):
+                    continue
+
+            f.setFields(self._dataset.fields, True)
+            f.setId(feature)
+            f.setAttributes(self._dataset.attributes[feature])
+            if not (self._request.flags() & QgsFeatureRequest.NoGeometry):
+                f.setGeometry(geometry or self._dataset.geometry(feature))
+            else:
+                f.clearGeometry()
+            f.setValid(True)
+            if self._request.filterType() == QgsFeatureRequest.FilterExpression:
+                self._request.expressionContext().setFeature(f)
+                if not self._request.filterExpression().evaluate(self._request.expressionContext()):
+                    continue
+            self.geometryToDestinationCrs(f, self._transform)
+            return True
+
+        f.setValid(False)
+        return False
+
+    def __iter__(self):
+        self._position = 0
+        return self
+
+    def __next__(self):
+        f = QgsFeature()
+        if not self.nextFeature(f):
+            raise StopIteration
+        return f
+
+    def rewind(self):
+        if self._position < 0:
+            return False
+        self._position = 0
+        return True
+
+    def close(self):
+        self._position = -1
+        return True
+
+class AerogenFeatureSource(QgsAbstractFeatureSource):
+    def __init__(self, provider):
+        """Snapshot of provider dataset, safe to iterate from other threads."""
+        super(AerogenFeatureSource, self).__init__()
+        self.dataset = provider.dataset()
+
+    def getFeatures(self, request):
+        return QgsFeatureIterator(AerogenFeatureIterator(self, request))
+
+class AerogenProvider(QgsVectorDataProvider):
+    @classmethod
+    def createProvider(cls, uri, providerOptions, flags=QgsDataProvider.ReadFlags()):
+        return AerogenProvider(uri, providerOptions, flags)
+
+    def __init__(self, uri='', providerOptions=QgsDataProvider.ProviderOptions(),
+                 flags=QgsDataProvider.ReadFlags()):
+        """Vector data provider serving registered dataset (see register()).
+
+        :param uri: key of registered dataset
+        """
+        super(AerogenProvider, self).__init__(uri, providerOptions, flags)
+        self._uri = uri
+        self._dataset = dataset(uri)
+
+    def dataset(self):
+        return self._dataset
+
+    def isValid(self):
+        return self._dataset is not None
+
+    def name(self):
+        return PROVIDER_KEY
+
+    def description(self):
+        return PROVIDER_DESCRIPTION
+
+    def dataSourceUri(self, expandAuthConfig=True):
+        return self._uri
+
+    def storageType(self):
+        return 'AeroGen survey arrays'
+
+    def featureSource(self):
+        return AerogenFeatureSource(self)
+
+    def getFeatures(self, request=QgsFeatureRequest()):
+        return QgsFeatureIterator(AerogenFeatureIterator(AerogenFeatureSource(self), request))
+
+    def wkbType(self):
+        return self._dataset.wkb_type() if self._dataset else QgsWkbTypes.Unknown
+
+    def featureCount(self):
+        return self._dataset.count() if self._dataset else 0
+
+    def fields(self):
+        return self._dataset.fields if self._dataset else QgsFields()
+
+    def crs(self):
+        return self._dataset.crs if self._dataset else crs_registry.crs('')
+
+    def extent(self):
+        return self._dataset.extent() if self._dataset else QgsRectangle()
+
+    def updateExtents(self):
+        pass
+
+    def capabilities(self):
+        return QgsVectorDataProvider.SelectAtId | QgsVectorDataProvider.ChangeGeometries
+
+    def changeGeometryValues(self, geometries):
+        """Move vertices of flight lines, spatial index is rebuilt."""
+        try:
+            self._dataset = self._dataset.changed(geometries)
+        except AerogenError as e:
+            self.pushError(str(e))
+            return False
+        register(self._uri, self._dataset)
+        return True
@@ -1,8 +1,25 @@
 import os
 import math
 
-from qgis.core import QgsGeometry, QgsLineString, QgsPointXY, QgsPoint, \
-    QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsProject
+import numpy as np
+
+from qgis.core import QgsPointXY
+
+from .generator import AerogenLineGenerator, clip_segments
+from .correction import correct_path
+from .session import AerogenSession
+from . import crs_registry
+from .geometry import polygon_geometry, polyline_geometry, transform_array
+from .exceptions import AerogenError
+
+# minimal shift of line endpoint (meters) reported as clipping modification
+CLIP_TOLERANCE = 0.01
+
+# altitude units (header L4) in meters
+ALTITUDE_UNITS = {
+    'm': 1.0,
+    'ft': 0.3048,
+}
 
 class AerogenReaderError(Exception):
     pass
@@ -10,8 +27,30 @@ class AerogenReaderError(Exception):
 class AerogenReaderCRS(Exception):
     pass
 
+def main_xyz_file(directory, opener=open):
+    """Returns name of the main XYZ file in the directory or None if not found."""
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(".xyz"):
+            try:
+                with opener(os.path.join(directory, filename)) as f:
+                    line = f.readline()
+                    # Not a nice detection, but if we base the detection of the main file
+                    # on the filename it may be even worse
+                    if line.startswith('UTM'):
+                        return filename
+            except (IOError, UnicodeDecodeError):
+                raise AerogenReaderError(filename)
+
+    return None
+
 class AerogenReader(object):
-    def __init__(self, filename):
+    def __init__(self, filename, opener=None):
+        """Aerogen XYZ reader.
+
+        :param filename: main XYZ file
+        :param opener: function used to open input files instead of
+        built-in open (eg. AerogenPrefetcher.open)
+        """
         def line_value(line, cast_fn=None):
             value = line.split(';', 1)[0]
             if cast_fn:
@@ -25,28 +64,65 @@ class AerogenReader(object):
         self._basename = os.path.splitext(os.path.basename(filename))[0]
 
         self._crs = self._cm = self._ns = None
+        self._altitude_units = 'm'
+        # detected EPSG code
+        self._epsg = None
+        self._lat = self._lon = None
+        self._hsl = self._ssl = self._htl = self._stl = None
+        self._xsl = self._ysl = self._xtl = self._ytl = None
+        self._osl = self._otl = None
         self._polygon_points = []
         self._line_points = []
 
+        self._open = opener or open
+
+        # generate lines from area polygon instead of reading them
+        self._generate = False
+        self._generated = {}
+        self._line_ids = {}
+        # run-in/run-out distance of clipped lines, None for no clipping
+        self._clip = None
+        self._clip_report = {}
+        # worker processes correcting connections, 0 for serial correction
+        self._workers = 0
+
         try:
-            with open(filename) as f:
-                for line in f.readlines():
+            with self._open(filename) as f:
+                # stream lines, input may be decompressed on the fly
+                for line in f:
                     line = line.rstrip('\n').strip()
                     # try to detect CRS
                     if 'L1' in line:
                         self._crs = line_value(line)
+                    if 'L4' in line:
+                        self._altitude_units = line_value(line).strip()
                     if line.endswith('CM'):
                         self._cm = line_value(line, cast_fn=int)
                     if line.endswith('Lat'):
-                        self._ns = line_value(line, cast_fn=float) > 0
+                        self._lat = line_value(line, cast_fn=float)
+                        self._ns = self._lat > 0
+                    if line.endswith('Lon'):
+                        self._lon = line_value(line, cast_fn=float)
                     if line.endswith('HSL'):
                         self._hsl = line_value(line, cast_fn=float) * (math.pi / 180) # rad
                     if line.endswith('spacing SL'):
                         self._ssl = line_value(line, cast_fn=float)
+                    if line.endswith('xSL'):
+                        self._xsl = line_value(line, cast_fn=float)
+                    if line.endswith('ySL'):
+                        self._ysl = line_value(line, cast_fn=float)
                     if line.endswith('HTL'):
                         self._htl = line_value(line, cast_fn=float) * (math.pi / 180) # rad
                     if line.endswith('spacing TL'):
                         self._stl = line_value(line, cast_fn=float)
+                    if line.endswith('xTL'):
+                        self._xtl = line_value(line, cast_fn=float)
+                    if line.endswith('yTL'):
+                        self._ytl = line_value(line, cast_fn=float)
+                    if line.endswith('offset SL'):
+                        self._osl = line_value(line, cast_fn=float)
+                    if line.endswith('offset TL'):
+                        self._otl = line_value(line, cast_fn=float)
 
                     # read coordinates
                     if line.startswith('c;'):    # polygon definition
@@ -71,20 +147,30 @@ class AerogenReader(object):
             float(x.strip()), float(y.strip())
         )
 
-    def area(self):
+    def area(self, crs=None):
+        """Returns area polygon geometry.
+
+        :param crs: output CRS, survey UTM zone if not given
+        """
         if len(self._polygon_points) < 3:
             raise AerogenReaderError("Unable to generate polygon geometry")
 
-        # close polygon
-        self._polygon_points.append(self._polygon_points[0])
+        # polygon is closed by geometry builder
+        return [self._to_crs(polygon_geometry(self.polygon()), crs)]
 
-        return [QgsGeometry.fromPolygonXY([self._polygon_points])]
+    def sl(self, crs=4326):
+        """Returns survey lines geometry.
 
-    def sl(self):
-        return [self._get_lines('sl')]
+        :param crs: output CRS, WGS84 if not given
+        """
+        return [self._get_lines('sl', crs)]
+
+    def tl(self, crs=4326):
+        """Returns tie lines geometry.
 
-    def tl(self):
-        return [self._get_lines('tl')]
+        :param crs: output CRS, WGS84 if not given
+        """
+        return [self._get_lines('tl', crs)]
 
     def _get_id(self, line):
         return line.split()[1]
@@ -101,112 +187,222 @@ class AerogenReader(object):
         items = line.split()
         return {items[4]: [items[2], items[3]]}
 
-    def _get_azimuth_diff(self, pt1, pt2, pt3):
-        """Returns difference between azimuths of two lines (pt1-pt2 and pt2-pt3)"""
-        first_segment_azimuth = pt1.azimuth(pt2)
-        if first_segment_azimuth < 0:
-            first_segment_azimuth += 360
-        second_segment_azimuth = pt2.azimuth(pt3)
-        if second_segment_azimuth < 0:
-            second_segment_azimuth += 360
-        diff = first_segment_azimuth - second_segment_azimuth
-        return diff
-
-    def _convert_to_crs(self, line_points):
-        """Converts line_points into UTM"""
-        crs_src = QgsCoordinateReferenceSystem(4326)
-        crs_dest = QgsCoordinateReferenceSystem(self.crs())
-        xform = QgsCoordinateTransform(crs_src, crs_dest, QgsProject.instance())
-        for i in range(len(line_points)):
-            line_points[i] = xform.transform(line_points[i])
-        return line_points
-
-    def _convert_to_wgs(self, line_points):
-        """Converts line_points into WGS84"""
-        crs_src = QgsCoordinateReferenceSystem(self.crs())
-        crs_dest = QgsCoordinateReferenceSystem(4326)
-        xform = QgsCoordinateTransform(crs_src, crs_dest, QgsProject.instance())
-        for i in range(len(line_points)):
-            line_points[i] = xform.transform(line_points[i])
-        return line_points
-
-    def _correct_first_segment(self, line_points):
-        """Switch first two points if the connection is not in good angle (close to normal).
-        It usually means that we took the first line in a wrong dirrection.
+    def _transform(self, crs_src, crs_dest):
+        return crs_registry.transform(crs_src, crs_dest)
+
+    def _convert_to_crs(self, xy):
+        """Converts (n, 2) array of coordinates into UTM"""
+        return transform_array(xy, self._transform(4326, self.crs()))
+
+    def _convert_to_wgs(self, xy):
+        """Converts (n, 2) array of coordinates into WGS84"""
+        return transform_array(xy, self._transform(self.crs(), 4326))
+
+    def set_generate_lines(self, generate):
+        """Generate survey and tie lines from area polygon and header
+        parameters instead of reading them from vendor files."""
+        self._generate = generate
+
+    def set_clip_lines(self, lead):
+        """Clip survey and tie lines to area polygon extended by run-in
+        and run-out distance.
+
+        :param lead: run-in/run-out distance in meters, None disables clipping
+        """
+        self._clip = lead
+        self._clip_report = {}
+
+    def set_correction_workers(self, workers):
+        """Correct connections of large surveys in chunks on process pool.
+
+        Result is identical to serial correction (see correct_path).
+        Only paths longer than correction.CHUNK_LINES lines are split,
+        eg. in batch processing::
+
+            reader = AerogenReader('survey.xyz')
+            reader.set_correction_workers(os.cpu_count())
+            xy = reader.line_array('sl')
+
+        Not used by the dock, worker processes cannot be started from
+        QGIS on platforms spawning them (Windows, macOS).
+
+        :param workers: number of worker processes, 0 for serial correction
         """
-        diff = self._get_azimuth_diff(line_points[0], line_points[1], line_points[2])
-        if (math.fabs(diff) > 70 and math.fabs(diff) < 110) \
-                or (math.fabs(diff) > 250 and math.fabs(diff) < 290):
-            # If the angle is about normal / 90 degrees, we do not do anything
-            return line_points
+        self._workers = workers
+
+    def clip_report(self, type):
+        """Returns list of (line id, status, shift) of lines modified by
+        clipping, status is 'trimmed', 'extended' or 'outside'."""
+        return self._clip_report.get(type, [])
+
+    def offset(self, type):
+        """Returns line numbering offset from header."""
+        return self._osl if type == 'sl' else self._otl
+
+    def polygon(self):
+        """Returns area polygon vertices as (n, 2) array."""
+        return np.array([(p.x(), p.y()) for p in self._polygon_points], dtype=float)
+
+    def spacing(self, type):
+        """Returns line spacing from header."""
+        return self._ssl if type == 'sl' else self._stl
+
+    def line_ids(self, type, count=None):
+        """Returns line numbers in flight order.
+
+        :param count: number of lines of flight path, AerogenReaderError
+        is raised when number of line numbers differs
+        """
+        if self._generate:
+            ids = AerogenLineGenerator.line_ids(type, len(self.generated_lines(type)),
+                                                self.offset(type))
         else:
-            if line_points[0].distance(line_points[1]) < (line_points[2].distance(line_points[3]) / 2):
-                pt0 = line_points[0]
-                line_points[0] = line_points[1]
-                line_points[1] = pt0
-            return line_points
-
-    def _correct_connections(self, line_points):
-        """We prolong the lines in a case when the connection is not in normal angle"""
-        i = 0
-        previous_diff = 90
-        while i < (len(line_points) - 3):
-            diff = self._get_azimuth_diff(line_points[i], line_points[i+1], line_points[i+2])
-            if not ((math.fabs(diff) > 85 and math.fabs(diff) < 95) or (math.fabs(diff) > 265 and math.fabs(diff) < 275)):
-                # The angle is not close to normal
-                if i == 0:
-                    # We are at the beginning and do not have previous diff, so we read next diff
-                    # TODO possible change to detect diff according to engles of the area, better results
-                    previous_diff = self._get_azimuth_diff(line_points[2], line_points[3], line_points[4])
-                distance_current = line_points[i].distance(line_points[i+1])
-                distance_next = line_points[i+2].distance(line_points[i+3])
-                line_g = QgsGeometry.fromPolylineXY([line_points[i + 1], line_points[i + 2]])
-                # hack - there is a problem of intersection on Windows - two lines that does not intersect
-                # have intersection result close to 0 0, but in digits of e-300
-                intersection_error_limit = 0.000000000001
-                if distance_current > distance_next:
-                    # we go from longer to shorter line
-                    line = QgsLineString(QgsPoint(line_points[i+2]), QgsPoint(line_points[i+3]))
-                    line.extend(distance_current, 0)
-                    # We rotate the line segment to find cross with extended line
-                    # The rotation is based on diff (rotate to be along extended line)
-                    # and angle of the previous normal line
-                    line_g.rotate(diff + (180 - previous_diff), line_points[i + 1])
-                    line = QgsGeometry.fromWkt(line.asWkt())
-                    intersection = line_g.intersection(line).centroid()
-                    if not intersection.isNull():
-                        intersection = intersection.asPoint()
-                        # hack
-                        if intersection.x() > intersection_error_limit and intersection.y() > intersection_error_limit:
-                            line_points[i + 2] = intersection
-                else:
-                    # we go from shorter to longer line
-                    line = QgsLineString(QgsPoint(line_points[i]), QgsPoint(line_points[i+1]))
-                    line.extend(0, distance_next)
-                    line_g.rotate(diff + (180 - previous_diff), line_points[i + 2])
-                    line = QgsGeometry.fromWkt(line.asWkt())
-                    intersection = line_g.intersection(line).centroid()
-                    if not intersection.isNull():
-                        intersection = intersection.asPoint()
-                        # hack
-                        if intersection.x() > intersection_error_limit and intersection.y() > intersection_error_limit:
-                            line_points[i + 1] = intersection
-            i+=2
-            previous_diff = diff
-
-        return line_points
-
-    def _get_lines(self, type):
+            if type not in self._line_ids:
+                self._read_lines(type)
+            ids = self._line_ids[type]
+        if count is not None and len(ids) != count:
+            raise AerogenReaderError("Number of line numbers ({}) does not match number of lines ({})".format(
+                len(ids), count))
+        return ids
+
+    def generated_lines(self, type):
+        """Returns lines generated from area polygon as (n, 2, 2) array in UTM."""
+        if type not in self._generated:
+            if type == 'sl':
+                heading, spacing, x, y = self._hsl, self._ssl, self._xsl, self._ysl
+            else:
+                heading, spacing, x, y = self._htl, self._stl, self._xtl, self._ytl
+            origin = (x, y) if x is not None and y is not None else None
+            try:
+                generator = AerogenLineGenerator(self.polygon(), heading, spacing, origin)
+            except AerogenError as e:
+                raise AerogenReaderError(e)
+            self._generated[type] = generator.lines()
+
+        return self._generated[type]
+
+    def write_generated_lines(self, type, filename):
+        """Write generated lines into XYZ file in vendor format."""
+        lines = self.generated_lines(type)
+        lonlat = self._convert_to_wgs(lines.reshape(-1, 2)).reshape(lines.shape)
+        header = [(self._lat, 'Lat'), (self._lon, 'Lon'), (self._cm, 'CM')]
+        try:
+            AerogenLineGenerator.write(filename, type, lines, lonlat,
+                                       [item for item in header if item[0] is not None],
+                                       self.offset(type))
+        except AerogenError as e:
+            raise AerogenReaderError(e)
+
+    def _get_lines(self, type, crs=4326):
+        return self._to_crs(polyline_geometry(self.line_array(type)), crs)
+
+    def altitude_units(self):
+        """Returns altitude units from header (L4)."""
+        return self._altitude_units
+
+    def line_geometries(self, type, crs=4326, altitude=None):
+        """Returns flight lines as separate LineStringM geometries.
+
+        M holds distance from line start in meters computed in UTM.
+
+        :param crs: output CRS, WGS84 if not given
+        :param altitude: planned altitude in header altitude units, lines
+        are LineStringZM with altitude in meters if given
+        """
+        return self.line_features(type, crs, altitude)[1]
+
+    def line_features(self, type, crs=4326, altitude=None):
+        """Returns line numbers and flight lines as separate geometries
+        (see line_geometries()).
+
+        :return: tuple of line numbers and list of geometries of the same length
+        """
+        xy = self.line_array(type)
+        count = len(xy) // 2
+        ids = self.line_ids(type, count)
+        xy = xy[:2 * count]
+        m = np.zeros(len(xy))
+        m[1::2] = np.hypot(*(xy[1::2] - xy[0::2]).T)
+        z = None
+        if altitude is not None:
+            if self._altitude_units not in ALTITUDE_UNITS:
+                raise AerogenReaderError("Unknown altitude units {}".format(self._altitude_units))
+            z = np.full(len(xy), altitude * ALTITUDE_UNITS[self._altitude_units])
+        if crs is not None and crs_registry.crs(crs) != crs_registry.crs(self.crs()):
+            xy = transform_array(xy, self._transform(self.crs(), crs))
+
+        return ids, [polyline_geometry(xy[i:i + 2], None if z is None else z[i:i + 2], m[i:i + 2])
+                     for i in range(0, len(xy), 2)]
+
+    def _to_crs(self, geom, crs):
+        """Transform geometry from survey UTM zone into CRS (all vertices at once)."""
+        if crs is not None and crs_registry.crs(crs) != crs_registry.crs(self.crs()):
+            geom.transform(self._transform(self.crs(), crs))
+        return geom
+
+    def raw_line_array(self, type):
+        """Returns flight path in UTM before correction as (n, 2) array."""
+        if self._generate:
+            return self.generated_lines(type).reshape(-1, 2)
+        return self._convert_to_crs(self._read_lines(type))
+
+    def line_array(self, type):
+        """Returns corrected flight path in UTM as (n, 2) array."""
+        xy = correct_path(self.raw_line_array(type), self._workers)[0]
+        if self._clip is not None:
+            xy = self._clip_lines(type, xy)
+        return xy
+
+    def session(self, type):
+        """Returns editable flight path corrected incrementally (see AerogenSession)."""
+        polygon = None
+        if self._clip is not None:
+            polygon = self.polygon()
+            if len(polygon) < 3:
+                raise AerogenReaderError("Unable to clip lines, area polygon not defined")
+        return AerogenSession(self.raw_line_array(type), polygon, self._clip)
+
+    def _clip_lines(self, type, xy):
+        """Clip (n, 2) flight path to area polygon and record modified lines."""
+        polygon = self.polygon()
+        if len(polygon) < 3:
+            raise AerogenReaderError("Unable to clip lines, area polygon not defined")
+
+        count = len(xy) // 2
+        lines = xy[:2 * count].reshape(-1, 2, 2)
+        clipped, hit = clip_segments(polygon, lines, self._clip)
+        shift = np.hypot(*(clipped - lines).transpose(2, 0, 1)).max(axis=1)
+        length = np.hypot(*(lines[:, 1] - lines[:, 0]).T)
+        clipped_length = np.hypot(*(clipped[:, 1] - clipped[:, 0]).T)
+        status = np.where(~hit, 'outside', np.where(clipped_length > length, 'extended', 'trimmed'))
+        modified = ~hit | (shift > CLIP_TOLERANCE)
+
+        ids = self.line_ids(type)
+        if len(ids) != count:
+            ids = np.arange(count)
+        self._clip_report[type] = [
+            (str(line_id), str(s), float(d))
+            for line_id, s, d in zip(ids[modified], status[modified], shift[modified])
+        ]
+
+        return np.vstack((clipped.reshape(-1, 2), xy[2 * count:]))
+
+    def _read_lines(self, type):
+        """Read line points (WGS84) from vendor file as (n, 2) array."""
         # Open the file with read only permit
-        f = open(self._dirname + "/" + self._basename + "_" + type + ".xyz", "r")
-        lines = f.readlines()
-        f.close()
+        try:
+            with self._open(self._dirname + "/" + self._basename + "_" + type + ".xyz", "r") as f:
+                lines = f.readlines()
+        except IOError as e:
+            raise AerogenReaderError(e)
         points = {}
         id = ''
+        ids = []
         line_points = []
         for line in lines:
             line = ' '.join(line.split())
             if line.startswith('Line'):
+                ids.append(self._get_id(line))
                 if id != '':
                     #print(id)
                     for key in sorted(points.keys()):
@@ -224,14 +420,14 @@ class AerogenReader(object):
                 points.update(point)
         for key in sorted(points.keys()):
             line_points.append(self._build_point(points[key][0], points[key][1]))
-        line_points = self._convert_to_crs(line_points)
-        line_points = self._correct_first_segment(line_points)
-        line_points = self._correct_connections(line_points)
-        line_points = self._convert_to_wgs(line_points)
-        return QgsGeometry.fromPolylineXY(line_points)
+        self._line_ids[type] = np.array(ids)
+        return np.array([(p.x(), p.y()) for p in line_points], dtype=float)
 
     def crs(self):
         """Detect Coordinate Reference System."""
+        if self._epsg is not None:
+            return self._epsg
+
         if self._crs == 'UTM':
             if self._cm is None:
                 raise AerogenReaderCRS("Unable to UTM zone")
@@ -239,9 +435,13 @@ class AerogenReader(object):
             ns = 6 if self._ns else 7
 
             # return EPSG code
-            return int('32{}{}'.format(ns, zone))
+            self._epsg = int('32{}{}'.format(ns, zone))
+            return self._epsg
 
         raise AerogenReaderCRS("Unable to detect CRS")
 
     def basename(self):
         return self._basename
+
+    def dirname(self):
+        return self._dirname
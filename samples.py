@@ -0,0 +1,122 @@
+import numpy as np
+
+from .waypoints import format_fixed, compose
+from .parallel import map_ordered
+from .exceptions import AerogenError
+
+# number of samples generated and written at once
+CHUNK_SIZE = 2000000
+
+COLUMNS = ('line', 'sample', 'time', 'distance', 'x', 'y')
+
+def _samples(task):
+    """Returns samples with indices in range as dictionary of arrays.
+
+    Module level function so that it can be run in worker processes.
+    """
+    start, stop, origin, direction, ids, counts, cumulative, step, interval = task
+    index = np.arange(start, stop)
+    line = np.searchsorted(cumulative, index, side='right')
+    sample = index - (cumulative[line] - counts[line])
+    distance = sample * step
+
+    return {
+        'line': ids[line],
+        'sample': sample,
+        'time': sample * interval,
+        'distance': distance,
+        'x': origin[line, 0] + distance * direction[line, 0],
+        'y': origin[line, 1] + distance * direction[line, 1],
+    }
+
+def _csv(task):
+    """Returns samples in range formatted as CSV rows."""
+    samples = _samples(task)
+    return compose([format_fixed(samples['line'], 0), b',', format_fixed(samples['sample'], 0), b',',
+                    format_fixed(samples['time'], 3), b',', format_fixed(samples['distance'], 2), b',',
+                    format_fixed(samples['x'], 2), b',', format_fixed(samples['y'], 2), b'\n'],
+                   len(samples['line']))
+
+class AerogenSampler(object):
+    def __init__(self, xy, ids, speed, rate):
+        """Simulator of instrument samples along planned lines.
+
+        Samples are taken every speed / rate meters from the start of
+        each line (turns are not sampled).
+
+        :param xy: corrected flight path as (n, 2) array in UTM, line k
+        is defined by points 2k and 2k+1 (see AerogenReader.line_array)
+        :param ids: line numbers, AerogenError is raised when their
+        number does not match number of lines
+        :param speed: aircraft ground speed in m/s
+        :param rate: instrument sample rate in Hz
+        """
+        if not speed or speed <= 0 or not rate or rate <= 0:
+            raise AerogenError("Speed and sample rate must be positive")
+
+        count = len(xy) // 2
+        xy = np.asarray(xy[:2 * count], dtype=float)
+        self._origin = xy[0::2]
+        ab = xy[1::2] - self._origin
+        length = np.hypot(*ab.T)
+        self._direction = ab / np.where(length > 0, length, 1)[:, np.newaxis]
+        if ids is not None and len(ids) != count:
+            raise AerogenError("Number of line numbers ({}) does not match number of lines ({})".format(
+                len(ids), count))
+        try:
+            self._ids = np.asarray(ids).astype(np.int64)
+        except (TypeError, ValueError):
+            # no or not numeric line numbers
+            self._ids = np.arange(count, dtype=np.int64)
+
+        self._interval = 1.0 / rate
+        self._step = speed * self._interval
+        self._counts = np.floor(length / self._step).astype(np.int64) + 1
+        self._cumulative = np.cumsum(self._counts)
+
+    def count(self):
+        """Returns total number of samples."""
+        return int(self._cumulative[-1]) if len(self._cumulative) else 0
+
+    def _tasks(self, chunk_size):
+        for start in range(0, self.count(), chunk_size):
+            yield (start, min(start + chunk_size, self.count()), self._origin, self._direction,
+                   self._ids, self._counts, self._cumulative, self._step, self._interval)
+
+    def chunks(self, chunk_size=CHUNK_SIZE, workers=0):
+        """Yield samples lazily as dictionaries of arrays (see COLUMNS).
+
+        :param workers: number of worker processes, 0 to generate
+        samples in the current process
+        """
+        return map_ordered(_samples, self._tasks(chunk_size), workers)
+
+    def write_csv(self, filename, chunk_size=CHUNK_SIZE, workers=0):
+        """Write samples into CSV file, coordinates are in UTM."""
+        with open(filename, 'wb') as f:
+            f.write(','.join(COLUMNS).encode('ascii') + b'\n')
+            for rows in map_ordered(_csv, self._tasks(chunk_size), workers):
+                f.write(rows)
+
+    def write_parquet(self, filename, crs=None, chunk_size=CHUNK_SIZE, workers=0):
+        """Write samples into Parquet file, one row group per chunk.
+
+        Requires pyarrow, coordinates are in UTM.
+
+        :param crs: CRS identifier stored in file metadata (eg. EPSG:32633
+        or WKT, see crs_registry.identifier)
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise AerogenError("Python module pyarrow is required to write Parquet files")
+
+        schema = pyarrow.schema(
+            [(name, pyarrow.int64() if name in ('line', 'sample') else pyarrow.float64())
+             for name in COLUMNS],
+            metadata={'crs': crs} if crs else None
+        )
+        with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+            for samples in self.chunks(chunk_size, workers):
+                writer.write_table(pyarrow.table(samples, schema=schema))
@@ -0,0 +1,228 @@
+import bisect
+
+import numpy as np
+
+from qgis.core import QgsFeatureRequest, QgsWkbTypes
+
+from .correction import correct_first_segment, correct_connections, correct_step
+from .generator import clip_segments
+from .geometry import polyline_geometry, transform_array
+from .exceptions import AerogenError
+
+# minimal vertex shift (meters) recognized as edit, smaller differences
+# come from transformation into layer CRS and back
+EDIT_TOLERANCE = 0.001
+
+class _Window(object):
+    """Flight path being corrected again from start, points up to start
+    are read from corrected path and the rest from path before
+    correction, only modified points are stored."""
+    def __init__(self, corrected, raw, start):
+        self._corrected = corrected
+        self._raw = raw
+        self.start = start
+        self._modified = {}
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __getitem__(self, index):
+        if index in self._modified:
+            return self._modified[index]
+        return self._corrected[index] if index <= self.start else self._raw[index]
+
+    def __setitem__(self, index, point):
+        self._modified[index] = point
+
+class AerogenSession(object):
+    def __init__(self, xy, polygon=None, lead=None):
+        """Editable flight path corrected incrementally.
+
+        Connection correction is local, step i reads points i..i+3 (and
+        2..4 for the first connection) and azimuth difference of the
+        previous connection. Moved points are recorded as dirty and
+        update() runs only steps reading them, followed by steps till
+        the point and azimuth difference entering a step match the
+        previous run.
+
+        :param xy: flight path in UTM before correction as (n, 2) array
+        (see AerogenReader.raw_line_array)
+        :param polygon: area polygon vertices as (m, 2) array, lines are
+        clipped if given (see AerogenReader.set_clip_lines)
+        :param lead: run-in/run-out distance of clipped lines in meters
+        """
+        self._raw = [(float(x), float(y)) for x, y in xy]
+        self._polygon = polygon
+        self._lead = lead or 0.0
+        self._dirty = set()
+        # feature ids of patched layers in path order
+        self._fids = {}
+
+        self._points = correct_first_segment(list(self._raw))
+        # azimuth difference entering each step
+        self._previous = correct_connections(self._points)
+        self._xy = np.array(self._points, dtype=float).reshape(-1, 2)
+        self._clip(np.arange(len(self._xy) // 2))
+
+    def _clip(self, lines):
+        """Clip lines of corrected path given by indices."""
+        if self._polygon is None or len(lines) == 0:
+            return
+        start = 2 * lines
+        segments = np.stack((self._xy[start], self._xy[start + 1]), axis=1)
+        clipped = clip_segments(self._polygon, segments, self._lead)[0]
+        self._xy[start] = clipped[:, 0]
+        self._xy[start + 1] = clipped[:, 1]
+
+    def points(self):
+        """Returns corrected flight path in UTM as (n, 2) array."""
+        return self._xy.copy()
+
+    def move(self, index, x, y):
+        """Move point of flight path before correction, applied by update().
+
+        :param index: point index, line k is defined by points 2k and 2k+1
+        :param x: new X coordinate in UTM
+        :param y: new Y coordinate in UTM
+        """
+        if index < 0 or index >= len(self._raw):
+            raise AerogenError("Point {} is out of flight path".format(index))
+        self._raw[index] = (float(x), float(y))
+        self._dirty.add(index)
+
+    def update(self):
+        """Correct connections affected by moved points.
+
+        :return: array of indices of changed points of corrected path
+        """
+        if not self._dirty:
+            return np.empty(0, dtype=np.int64)
+        dirty = sorted(self._dirty)
+        self._dirty = set()
+        count = len(self._raw)
+
+        work = _Window(self._points, self._raw, -1)
+        corrected = {}
+        k = 0
+        while k < len(dirty):
+            if dirty[k] <= 4:
+                # first segment and the first step (reads points up to 4)
+                start = 0
+                correct_first_segment(work)
+                previous_diff = 90
+            else:
+                # smallest step reading the moved point
+                start = (dirty[k] - 2) // 2 * 2
+                work.start = start
+                previous_diff = self._previous[start // 2] if start // 2 < len(self._previous) else 90
+
+            stop = count
+            k = len(dirty)
+            i = start
+            while i < count - 3:
+                self._previous[i // 2] = previous_diff
+                previous_diff = correct_step(work, i, previous_diff)
+                i += 2
+                if i < count - 3 and work[i] == self._points[i] and previous_diff == self._previous[i // 2]:
+                    # next steps are the same as before unless they read moved point
+                    k = bisect.bisect_left(dirty, i + 1)
+                    if k == len(dirty) or dirty[k] > i + 3:
+                        stop = i + 1
+                        break
+                    k = len(dirty)
+            # before window is moved to the next moved point
+            corrected.update((j, work[j]) for j in range(start, stop) if work[j] != self._points[j])
+
+        if not corrected:
+            return np.empty(0, dtype=np.int64)
+
+        changed = np.array(sorted(corrected), dtype=np.int64)
+        if self._polygon is not None:
+            # both endpoints are clipped again from corrected path
+            lines = np.unique(changed // 2)
+            lines = lines[2 * lines + 1 < count]
+            affected = np.union1d(changed, np.concatenate((2 * lines, 2 * lines + 1)))
+        else:
+            lines = None
+            affected = changed
+        previous = self._xy[affected]
+        for j, point in corrected.items():
+            self._points[j] = point
+        self._xy[affected] = np.array([self._points[j] for j in affected], dtype=float).reshape(-1, 2)
+        if lines is not None:
+            self._clip(lines)
+
+        return affected[(self._xy[affected] != previous).any(axis=1)]
+
+    def _layer_fids(self, layer):
+        """Returns dictionary of feature positions in path order by feature id."""
+        if layer.id() not in self._fids:
+            request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+            self._fids[layer.id()] = {feature.id(): k for k, feature in enumerate(layer.getFeatures(request))}
+        return self._fids[layer.id()]
+
+    def edited(self, layer, geometries, xform=None):
+        """Move points edited in the layer (see move()).
+
+        Layer holds either the whole flight path as single linestring
+        (see AerogenReader.sl) or one feature per line in path order
+        (see AerogenReader.line_geometries).
+
+        :param geometries: dictionary of edited geometries by feature id
+        (see QgsVectorLayer.committedGeometriesChanges)
+        :param xform: optional QgsCoordinateTransform from layer CRS into UTM
+        """
+        fids = self._layer_fids(layer)
+        for fid, geom in geometries.items():
+            if fid not in fids:
+                raise AerogenError("Adding flight lines is not supported")
+            xy = np.array([(v.x(), v.y()) for v in geom.vertices()], dtype=float)
+            if xform is not None:
+                xy = transform_array(xy, xform)
+            start = 0 if len(fids) == 1 else 2 * fids[fid]
+            expected = self._xy[start:start + len(xy)]
+            if len(xy) != (len(self._xy) if len(fids) == 1 else 2) or len(expected) != len(xy):
+                raise AerogenError("Only vertices of flight lines can be moved")
+            for index in np.flatnonzero(np.hypot(*(xy - expected).T) > EDIT_TOLERANCE):
+                self.move(start + int(index), *xy[index])
+
+    def patch(self, layer, indices, xform=None):
+        """Update geometries of the layer in place (see edited()).
+
+        :param indices: indices of changed points (see update())
+        :param xform: optional QgsCoordinateTransform from UTM into layer CRS
+        """
+        if len(indices) == 0:
+            return
+        fids = self._layer_fids(layer)
+        order = sorted(fids, key=fids.get)
+        changes = {}
+        if len(order) == 1:
+            xy = self._xy[indices]
+            if xform is not None:
+                xy = transform_array(xy, xform)
+            geom = layer.getFeature(order[0]).geometry()
+            for index, (x, y) in zip(indices, xy):
+                geom.moveVertex(x, y, int(index))
+            changes[order[0]] = geom
+        else:
+            lines = np.unique(np.asarray(indices) // 2)
+            ab = np.stack((self._xy[2 * lines], self._xy[2 * lines + 1]), axis=1)
+            # M holds distance from line start in UTM
+            length = np.hypot(*(ab[:, 1] - ab[:, 0]).T)
+            xy = ab.reshape(-1, 2)
+            if xform is not None:
+                xy = transform_array(xy, xform)
+            for k, line in enumerate(lines):
+                fid = order[line]
+                geom = layer.getFeature(fid).geometry()
+                wkb_type = geom.wkbType()
+                z = None
+                if QgsWkbTypes.hasZ(wkb_type):
+                    z = np.full(2, geom.vertexAt(0).z())
+                m = np.array([0.0, length[k]]) if QgsWkbTypes.hasM(wkb_type) else None
+                changes[fid] = polyline_geometry(xy[2 * k:2 * k + 2], z, m)
+
+        layer.dataProvider().changeGeometryValues(changes)
+        layer.updateExtents()
+        layer.triggerRepaint()
@@ -0,0 +1,84 @@
+# coding=utf-8
+"""Archive tests."""
+
+import os
+import gzip
+import shutil
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+from ..archive import AerogenArchive
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'sample_data', 'data_01_demo')
+
+
+class AerogenArchiveTest(unittest.TestCase):
+    """Test reading survey files from archives."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = sorted(filename for filename in os.listdir(SAMPLE_DIR)
+                                if filename.endswith('.xyz'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _content(self, filename):
+        with open(os.path.join(SAMPLE_DIR, filename), 'rb') as f:
+            return f.read()
+
+    def _tar(self, name, mode):
+        path = os.path.join(self.directory, name)
+        with tarfile.open(path, mode) as t:
+            for filename in self.filenames:
+                t.add(os.path.join(SAMPLE_DIR, filename), 'survey/' + filename)
+        return path
+
+    def _check(self, path):
+        archive = AerogenArchive(path)
+        self.assertEqual(archive.members(), self.filenames)
+        self.assertEqual(archive.main_file(), 'area_a.xyz')
+        for filename in self.filenames:
+            with archive.open(os.path.join(path, filename), 'rb') as f:
+                self.assertEqual(f.read(), self._content(filename))
+        # text mode as loose files are read by AerogenReader
+        with archive.open('area_a_sl.xyz') as f, \
+                open(os.path.join(SAMPLE_DIR, 'area_a_sl.xyz')) as expected:
+            self.assertEqual(f.read(), expected.read())
+
+    def test_tar_gz(self):
+        """Members of compressed tar are streamed."""
+        self._check(self._tar('survey.tar.gz', 'w:gz'))
+
+    def test_tar(self):
+        """Members of uncompressed tar are read from their offsets."""
+        self._check(self._tar('survey.tar', 'w'))
+
+    def test_zip(self):
+        path = os.path.join(self.directory, 'survey.zip')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+            for filename in self.filenames:
+                z.write(os.path.join(SAMPLE_DIR, filename), 'survey/' + filename)
+        self._check(path)
+
+    def test_compressed_file(self):
+        """Survey files compressed next to the selected file are members."""
+        for filename in self.filenames:
+            with gzip.open(os.path.join(self.directory, filename + '.gz'), 'wb') as f:
+                f.write(self._content(filename))
+        with gzip.open(os.path.join(self.directory, 'other.xyz.gz'), 'wb') as f:
+            f.write(b'UTM')
+        self._check(os.path.join(self.directory, 'area_a_tl.xyz.gz'))
+
+    def test_missing_member(self):
+        archive = AerogenArchive(self._tar('survey.tar.gz', 'w:gz'))
+        with self.assertRaises(IOError):
+            archive.open('missing.xyz')
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AerogenArchiveTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,51 @@
+# coding=utf-8
+"""Connection correction tests."""
+
+import unittest
+
+import numpy as np
+
+from ..correction import correct_path
+
+
+def random_path(rng, count, spacing=100.0, length=2000.0, noise=40.0):
+    """Returns serpentine flight path of count lines with random endpoints."""
+    xy = np.empty((2 * count, 2))
+    x = np.arange(count) * spacing
+    xy[0::2, 0] = x
+    xy[1::2, 0] = x
+    # lines flown in alternating directions
+    xy[0::2, 1] = np.where(np.arange(count) % 2, length, 0.0)
+    xy[1::2, 1] = np.where(np.arange(count) % 2, 0.0, length)
+    return xy + rng.uniform(-noise, noise, xy.shape)
+
+
+class CorrectionTest(unittest.TestCase):
+    """Test parallel correction of connections."""
+
+    def test_parallel_identical(self):
+        """Chunks corrected on process pool give the same path as serial correction."""
+        rng = np.random.RandomState(0)
+        for chunk_lines in range(1, 51):
+            xy = random_path(rng, rng.randint(chunk_lines + 1, 3 * chunk_lines + 20))
+            expected, expected_previous = correct_path(xy.copy())
+            result, previous = correct_path(xy.copy(), workers=2, chunk_lines=chunk_lines)
+            self.assertEqual(result.tobytes(), expected.tobytes(),
+                             'chunk of {} lines'.format(chunk_lines))
+            self.assertEqual(previous, expected_previous)
+
+    def test_parallel_random_points(self):
+        """Paths of random points are corrected identically as well."""
+        rng = np.random.RandomState(1)
+        for chunk_lines in (1, 2, 3, 7, 50):
+            xy = rng.uniform(0, 1000, (2 * (chunk_lines + 40) + 1, 2))
+            expected = correct_path(xy.copy())[0]
+            result = correct_path(xy.copy(), workers=2, chunk_lines=chunk_lines)[0]
+            self.assertEqual(result.tobytes(), expected.tobytes(),
+                             'chunk of {} lines'.format(chunk_lines))
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(CorrectionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Prefetcher tests."""
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from ..prefetch import AerogenPrefetcher
+
+# file access latency simulating network mount
+LATENCY = 0.05
+
+
+class AerogenPrefetcherTest(unittest.TestCase):
+    """Test concurrent fetching of survey files."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, 'cache')
+        self.filenames = ['survey_{}.xyz'.format(i) for i in range(16)]
+        for filename in self.filenames:
+            self._write(filename, filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, filename, text):
+        with open(os.path.join(self.directory, filename), 'w') as f:
+            f.write(text)
+
+    def _read(self, prefetcher, filename):
+        with prefetcher.open(os.path.join(self.directory, filename)) as f:
+            return f.read()
+
+    def test_parallel_fetch(self):
+        """Files are fetched concurrently."""
+        prefetcher = AerogenPrefetcher(self.directory, workers=8, latency=LATENCY)
+        start = time.time()
+        prefetcher.fetch()
+        elapsed = time.time() - start
+        # serial fetch takes len(filenames) * LATENCY
+        self.assertLess(elapsed, len(self.filenames) * LATENCY / 2)
+        for filename in self.filenames:
+            self.assertEqual(self._read(prefetcher, filename), filename)
+
+    def test_changed_file(self):
+        """Buffered file is served till refreshed."""
+        prefetcher = AerogenPrefetcher(self.directory, self.cache_dir)
+        prefetcher.fetch()
+        self._write(self.filenames[0], 'changed')
+        self.assertEqual(self._read(prefetcher, self.filenames[0]), self.filenames[0])
+        self.assertEqual(prefetcher.refresh(), [self.filenames[0]])
+        self.assertEqual(self._read(prefetcher, self.filenames[0]), 'changed')
+
+    def test_open_latency(self):
+        """Buffered files are opened without accessing the directory."""
+        prefetcher = AerogenPrefetcher(self.directory, latency=LATENCY)
+        prefetcher.fetch()
+        start = time.time()
+        for filename in self.filenames:
+            self._read(prefetcher, filename)
+        self.assertLess(time.time() - start, LATENCY)
+
+    def test_refresh(self):
+        """Only changed files are reported and fetched again."""
+        prefetcher = AerogenPrefetcher(self.directory)
+        prefetcher.fetch()
+        self.assertEqual(prefetcher.refresh(), [])
+        self._write(self.filenames[1], 'changed')
+        os.remove(os.path.join(self.directory, self.filenames[2]))
+        self.assertEqual(sorted(prefetcher.refresh()), sorted(self.filenames[1:3]))
+        self.assertEqual(self._read(prefetcher, self.filenames[1]), 'changed')
+
+    def test_cache_eviction(self):
+        """Cache directory is kept in size limit."""
+        size = sum(len(filename) for filename in self.filenames)
+        prefetcher = AerogenPrefetcher(self.directory, self.cache_dir, cache_size=size // 2)
+        prefetcher.fetch()
+        cached = sum(os.path.getsize(os.path.join(self.cache_dir, filename))
+                     for filename in os.listdir(self.cache_dir))
+        self.assertLessEqual(cached, size // 2)
+        self.assertGreater(cached, 0)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AerogenPrefetcherTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""Incremental correction tests."""
+
+import unittest
+
+import numpy as np
+
+from ..correction import correct_path
+from ..generator import clip_segments
+from ..session import AerogenSession
+from .test_correction import random_path
+
+
+def clipped(xy, polygon, lead):
+    """Returns flight path clipped as by AerogenReader.line_array."""
+    lines = xy.reshape(-1, 2, 2)
+    return clip_segments(polygon, lines, lead)[0].reshape(-1, 2)
+
+
+class AerogenSessionTest(unittest.TestCase):
+    """Test that incremental correction matches full correction."""
+
+    def _check(self, count, polygon=None, lead=None):
+        rng = np.random.RandomState(count)
+        raw = random_path(rng, count)
+        session = AerogenSession(raw, polygon, lead)
+        for trial in range(50):
+            before = session.points()
+            for index in rng.randint(0, len(raw), rng.randint(1, 4)):
+                raw[index] += rng.normal(0, 30, 2)
+                session.move(int(index), *raw[index])
+            changed = session.update()
+
+            expected = correct_path(raw)[0]
+            if polygon is not None:
+                expected = clipped(expected, polygon, lead)
+            self.assertEqual(session.points().tobytes(), expected.tobytes(),
+                             '{} lines, edit {}'.format(count, trial))
+            np.testing.assert_array_equal(
+                np.sort(changed), np.flatnonzero((before != expected).any(axis=1)))
+
+    def test_short_paths(self):
+        for count in (2, 3, 4):
+            self._check(count)
+
+    def test_vertex_edits(self):
+        self._check(200)
+
+    def test_clipped(self):
+        """Edited lines are clipped again to area polygon."""
+        polygon = np.array([(300.0, 300.0), (15000.0, 200.0), (16000.0, 1700.0), (200.0, 1800.0)])
+        self._check(200, polygon, 50.0)
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(AerogenSessionTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,86 @@
+# coding=utf-8
+"""Track replay tests."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from ..tracking import AerogenLineIndex, read_nmea
+from .test_correction import random_path
+
+NMEA = """$GPRMC,120000.00,A,4807.038,N,01131.000,E,022.4,084.4,230394,003.1,W*6A
+$GPGGA,120000.00,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47
+$GPRMC,120001.00,A,4807.039,N,01131.001,E,022.4,084.4,230394,003.1,W*6A
+$GPGGA,120001.00,4807.039,N,01131.001,E,1,08,0.9,545.4,M,46.9,M,,*47
+$GPGGA,120002.00,4807.040,N,01131.002,E,1,08,0.9,545.4,M,46.9,M,,*47
+$GPRMC,120003.00,A,4807.041,N,01131.003,E,022.4,084.4,230394,003.1,W*6A
+$GPGGA,120004.00,4807.042,N,01131.004,E,0,00,,,M,,M,,*47
+"""
+
+
+def brute_force(xy, points):
+    """Returns distance of each point to the nearest line."""
+    a, b = xy[0::2], xy[1::2]
+    ab = b - a
+    ap = points[:, np.newaxis, :] - a
+    t = np.clip((ap * ab).sum(axis=2) / (ab * ab).sum(axis=1), 0, 1)
+    return np.hypot(*(ap - t[..., np.newaxis] * ab).transpose(2, 0, 1)).min(axis=1)
+
+
+class AerogenLineIndexTest(unittest.TestCase):
+    """Test nearest line search."""
+
+    def test_nearest_line(self):
+        """Nearest lines match brute force search near and far from lines."""
+        rng = np.random.RandomState(0)
+        xy = random_path(rng, 60)
+        index = AerogenLineIndex(xy)
+        low, high = xy.min(axis=0), xy.max(axis=0)
+        points = np.concatenate((
+            # over the survey
+            rng.uniform(low, high, (2000, 2)),
+            # turns and ferry legs
+            rng.uniform(low - 5000, high + 5000, (2000, 2)),
+            rng.uniform(low - 100000, high + 100000, (200, 2)),
+        ))
+        line = index.query(points)[0]
+        self.assertTrue((line >= 0).all())
+        a, b = xy[0::2][line], xy[1::2][line]
+        ab = b - a
+        ap = points - a
+        t = np.clip((ap * ab).sum(axis=1) / (ab * ab).sum(axis=1), 0, 1)
+        distance = np.hypot(*(ap - t[:, np.newaxis] * ab).T)
+        np.testing.assert_allclose(distance, brute_force(xy, points), rtol=1e-9)
+
+
+class ReadNmeaTest(unittest.TestCase):
+    """Test reading of NMEA logs."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'track.nmea')
+        with open(self.filename, 'w') as f:
+            f.write(NMEA)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_epochs(self):
+        """One position is read per epoch, RMC only till the first GGA."""
+        xy = np.concatenate(list(read_nmea(self.filename)))
+        np.testing.assert_allclose(xy[:, 1] * 60 - 48 * 60, [7.038, 7.039, 7.040])
+        np.testing.assert_allclose(xy[:, 0] * 60 - 11 * 60, [31.000, 31.001, 31.002])
+
+    def test_chunks(self):
+        """Positions are yielded in chunks."""
+        self.assertEqual([len(chunk) for chunk in read_nmea(self.filename, 2)], [2, 1])
+
+
+if __name__ == "__main__":
+    suite = unittest.TestSuite([unittest.makeSuite(AerogenLineIndexTest),
+                                unittest.makeSuite(ReadNmeaTest)])
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
@@ -0,0 +1,318 @@
+import csv
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from .geometry import transform_array
+
+# number of fixes processed at once
+CHUNK_SIZE = 100000
+
+# rings of cells searched at grid level before the coarser level is used
+MAX_RING = 2
+
+class AerogenLineIndex(object):
+    def __init__(self, xy, ids=None, cell_size=None):
+        """Uniform grid index over planned flight lines.
+
+        Grid levels with cell size doubled at each level are built up to
+        the level covering all lines by one cell, so that fixes far from
+        lines (turns, ferry legs) are searched on coarser levels.
+
+        :param xy: corrected flight path as (n, 2) array in UTM, line k
+        is defined by points 2k and 2k+1 (see AerogenReader.line_array)
+        :param ids: line numbers
+        :param cell_size: grid cell size in meters, estimated from line
+        spacing if not given
+        """
+        count = len(xy) // 2
+        self._a = np.asarray(xy[0:2 * count:2], dtype=float)
+        self._b = np.asarray(xy[1:2 * count:2], dtype=float)
+        self._ab = self._b - self._a
+        self._length = np.hypot(*self._ab.T)
+        self._length2 = np.where(self._length > 0, self._length ** 2, np.nan)
+        self._ids = np.asarray(ids) if ids is not None else np.arange(count)
+
+        if cell_size is None:
+            middle = (self._a + self._b) / 2
+            spacing = np.hypot(*np.diff(middle, axis=0).T) if count > 1 else self._length
+            cell_size = max(float(np.median(spacing)) if len(spacing) else 1.0, 10.0)
+        self._cell = cell_size
+        self._origin = np.minimum(self._a.min(axis=0), self._b.min(axis=0)) if count else np.zeros(2)
+        self._levels = []
+        if count:
+            while True:
+                self._levels.append(self._build(self._cell * 2 ** len(self._levels)))
+                if (self._levels[-1]['high'] == 0).all():
+                    # one cell holds all lines
+                    break
+
+    def _build(self, cell):
+        """Register each line in all cells of given size it passes through."""
+        # sample lines at half cell size so that no crossed cell is missed
+        steps = np.ceil(self._length / (cell / 2)).astype(int) + 1
+        line = np.repeat(np.arange(len(steps)), steps)
+        first = np.cumsum(steps) - steps
+        t = (np.arange(steps.sum()) - first[line]) / np.maximum(steps[line] - 1, 1)
+        points = self._a[line] + t[:, np.newaxis] * self._ab[line]
+        cells = self._cells(points, cell)
+        pairs = np.unique(np.column_stack((self._keys(cells), line)), axis=0)
+
+        keys, starts, counts = np.unique(pairs[:, 0], return_index=True, return_counts=True)
+        # range of cells with registered lines
+        return {'cell': cell, 'keys': keys, 'starts': starts, 'counts': counts,
+                'entries': pairs[:, 1], 'low': cells.min(axis=0), 'high': cells.max(axis=0)}
+
+    def _cells(self, points, cell):
+        return np.floor((points - self._origin) / cell).astype(np.int64)
+
+    @staticmethod
+    def _keys(cells):
+        # pack (column, row) into one integer key, offsets keep values positive
+        return (cells[..., 0] + (1 << 30)) << 31 | (cells[..., 1] + (1 << 30))
+
+    @staticmethod
+    def _ring(ring):
+        """Returns (column, row) offsets of cells in ring around cell,
+        cells of rings up to 1 for ring 1."""
+        if ring <= 1:
+            return np.array([(i, j) for i in (-1, 0, 1) for j in (-1, 0, 1)])
+        side = np.arange(-ring, ring)
+        return np.concatenate((
+            np.column_stack((side, np.full(len(side), -ring))),
+            np.column_stack((np.full(len(side), ring), side)),
+            np.column_stack((-side, np.full(len(side), ring))),
+            np.column_stack((np.full(len(side), -ring), -side)),
+        ))
+
+    def ids(self):
+        return self._ids
+
+    def lengths(self):
+        return self._length
+
+    def query(self, points):
+        """Find nearest planned line for each point.
+
+        Cells around each point are searched in expanding rings till the
+        nearest line found is closer than any line registered only in
+        cells not searched yet. Search continues on coarser grid level
+        after MAX_RING rings, points far from lines start on the level
+        where the grid is at most one cell away.
+
+        :param points: (n, 2) array of positions in UTM
+
+        :return: tuple of line indices, cross-track errors (positive on
+        the right side of the line direction) and along-track chainages
+        """
+        points = np.asarray(points, dtype=float)
+        line = np.full(len(points), -1)
+        distance = np.full(len(points), np.inf)
+        if len(points) == 0 or len(self._a) == 0:
+            return line, np.full(len(points), np.nan), np.full(len(points), np.nan)
+
+        # distance of points to grid cells with lines in multiples of
+        # level 0 cell size
+        gap = np.maximum(np.maximum(self._levels[0]['low'] * self._cell - (points - self._origin),
+                                    (points - self._origin) - (self._levels[0]['high'] + 1) * self._cell),
+                         0).max(axis=1) / self._cell
+        level = np.clip(np.ceil(np.log2(np.maximum(gap, 1))).astype(int), 0, len(self._levels) - 1)
+        ring = np.ones(len(points), dtype=int)
+        active = np.arange(len(points))
+        while len(active):
+            done = np.zeros(len(active), dtype=bool)
+            for k in np.unique(level[active]):
+                grid = self._levels[k]
+                at_level = level[active] == k
+                cells = self._cells(points[active[at_level]], grid['cell'])
+                # rings farther than the last grid cell hold no more lines
+                last = np.maximum(np.abs(cells - grid['low']), np.abs(cells - grid['high'])).max(axis=1)
+                for r in np.unique(ring[active[at_level]]):
+                    in_ring = ring[active[at_level]] == r
+                    self._search(grid, points, active[at_level][in_ring], cells[in_ring], r, line, distance)
+                # line sampling may miss cell crossed over less than quarter of cell,
+                # lines in unsearched rings are then at least (ring - 1/4) cells away
+                index = active[at_level]
+                done[at_level] = (distance[index] <= (ring[index] - 0.25) * grid['cell']) | \
+                    (ring[index] >= last)
+            active = active[~done]
+            ring[active] += 1
+            coarser = (ring[active] > MAX_RING) & (level[active] < len(self._levels) - 1)
+            level[active[coarser]] += 1
+            ring[active[coarser]] = 1
+
+        return (line, ) + self._project(points, line)
+
+    def _search(self, grid, points, index, cells, ring, line, distance):
+        """Update nearest lines of points given by index from cells of ring."""
+        offsets = self._ring(ring)
+        step = max(1, CHUNK_SIZE * 10 // len(offsets))
+        for start in range(0, len(index), step):
+            chunk = index[start:start + step]
+            keys = self._keys(cells[start:start + step][:, np.newaxis, :] + offsets).ravel()
+            pos = np.searchsorted(grid['keys'], keys)
+            pos = np.minimum(pos, len(grid['keys']) - 1)
+            found = grid['keys'][pos] == keys
+            counts = np.where(found, grid['counts'][pos], 0)
+            point = chunk[np.repeat(np.arange(len(keys)) // len(offsets), counts)]
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            entry = np.repeat(np.where(found, grid['starts'][pos], 0), counts) + \
+                np.arange(counts.sum()) - first
+            candidate = grid['entries'][entry]
+
+            d = self._distance(points[point], candidate)
+            np.minimum.at(distance, point, d)
+            best = d == distance[point]
+            line[point[best]] = candidate[best]
+
+    def _distance(self, points, lines):
+        ap = points - self._a[lines]
+        t = np.clip(np.nan_to_num((ap * self._ab[lines]).sum(axis=1) / self._length2[lines]), 0, 1)
+        return np.hypot(*(ap - t[:, np.newaxis] * self._ab[lines]).T)
+
+    def _project(self, points, lines):
+        """Returns signed cross-track error and chainage."""
+        ap = points - self._a[lines]
+        length = np.where(self._length[lines] > 0, self._length[lines], np.nan)
+        chainage = (ap * self._ab[lines]).sum(axis=1) / length
+        cross = (ap[:, 0] * self._ab[lines, 1] - ap[:, 1] * self._ab[lines, 0]) / length
+
+        return cross, chainage
+
+class AerogenTrackReplay(object):
+    def __init__(self, index, tolerance=50, bin_size=100):
+        """Replay positions against planned lines and collect coverage.
+
+        :param index: AerogenLineIndex
+        :param tolerance: maximal cross-track error of position covering
+        the line (meters)
+        :param bin_size: length of line bins used for coverage (meters)
+        """
+        self._index = index
+        self._tolerance = tolerance
+        self._bin_size = bin_size
+
+        lengths = index.lengths()
+        self._bins = np.maximum(np.ceil(lengths / bin_size).astype(int), 1)
+        self._first_bin = np.cumsum(self._bins) - self._bins
+        self._covered = np.zeros(self._bins.sum(), dtype=bool)
+        count = len(lengths)
+        self._fixes = np.zeros(count, dtype=int)
+        self._sum_error = np.zeros(count)
+        self._max_error = np.zeros(count)
+
+    def update(self, points):
+        """Process batch of positions in UTM.
+
+        :return: tuple of line indices, cross-track errors and chainages
+        """
+        line, cross, chainage = self._index.query(points)
+        lengths = self._index.lengths()
+        on_line = (line >= 0) & (np.abs(cross) <= self._tolerance) & \
+            (chainage >= 0) & (chainage <= lengths[np.maximum(line, 0)])
+        l = line[on_line]
+        error = np.abs(cross[on_line])
+        self._fixes += np.bincount(l, minlength=len(self._fixes))
+        self._sum_error += np.bincount(l, weights=error, minlength=len(self._fixes))
+        np.maximum.at(self._max_error, l, error)
+        bins = np.minimum((chainage[on_line] // self._bin_size).astype(int), self._bins[l] - 1)
+        self._covered[self._first_bin[l] + bins] = True
+
+        return line, cross, chainage
+
+    def replay(self, chunks, xform=None):
+        """Process stream of position chunks.
+
+        :param chunks: iterable of (n, 2) arrays
+        :param xform: optional QgsCoordinateTransform into UTM
+        """
+        for chunk in chunks:
+            if xform is not None:
+                chunk = transform_array(chunk, xform)
+            self.update(chunk)
+
+    def summary(self):
+        """Returns per line coverage summary as list of dicts."""
+        covered = np.add.reduceat(self._covered.astype(int), self._first_bin) if len(self._bins) else []
+        result = []
+        for i, line_id in enumerate(self._index.ids()):
+            fixes = int(self._fixes[i])
+            result.append({
+                'line': str(line_id),
+                'coverage': float(covered[i]) / float(self._bins[i]),
+                'fixes': fixes,
+                'mean_xte': float(self._sum_error[i]) / fixes if fixes else None,
+                'max_xte': float(self._max_error[i]) if fixes else None,
+            })
+
+        return result
+
+    def write_summary(self, filename):
+        """Write coverage summary into CSV file."""
+        rows = self.summary()
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['line', 'coverage', 'fixes', 'mean_xte', 'max_xte'])
+            writer.writeheader()
+            writer.writerows(rows)
+
+def _nmea_degrees(value, hemisphere):
+    """Convert NMEA (d)ddmm.mmmm value into degrees."""
+    value = float(value)
+    degrees = int(value // 100)
+    result = degrees + (value - degrees * 100) / 60
+    return -result if hemisphere in ('S', 'W') else result
+
+def read_nmea(filename, chunk_size=CHUNK_SIZE):
+    """Read positions from NMEA log (GGA and RMC sentences).
+
+    One position is read per epoch, GGA sentences are preferred and RMC
+    sentences are used only till the first GGA sentence is found (logs
+    without GGA sentences).
+
+    Yields (n, 2) arrays of WGS84 longitudes and latitudes.
+    """
+    chunk = []
+    gga = False
+    # UTC time of last position
+    last = None
+    with open(filename, errors='replace') as f:
+        for line in f:
+            items = line.strip().split('*', 1)[0].split(',')
+            sentence = items[0][-3:]
+            try:
+                if sentence == 'GGA' and len(items) > 6 and items[6] not in ('', '0'):
+                    gga = True
+                    lat, ns, lon, ew = items[2:6]
+                elif sentence == 'RMC' and not gga and len(items) > 6 and items[2] == 'A':
+                    lat, ns, lon, ew = items[3:7]
+                else:
+                    continue
+                if items[1] and items[1] == last:
+                    # epoch already read from other sentence
+                    continue
+                chunk.append((_nmea_degrees(lon, ew), _nmea_degrees(lat, ns)))
+                last = items[1]
+            except ValueError:
+                # incomplete sentence
+                continue
+            if len(chunk) >= chunk_size:
+                yield np.array(chunk)
+                chunk = []
+    if chunk:
+        yield np.array(chunk)
+
+def read_gpx(filename, chunk_size=CHUNK_SIZE):
+    """Read track points from GPX file.
+
+    Yields (n, 2) arrays of WGS84 longitudes and latitudes.
+    """
+    chunk = []
+    for _, element in ET.iterparse(filename):
+        if element.tag.endswith('trkpt'):
+            chunk.append((float(element.get('lon')), float(element.get('lat'))))
+            element.clear()
+            if len(chunk) >= chunk_size:
+                yield np.array(chunk)
+                chunk = []
+    if chunk:
+        yield np.array(chunk)
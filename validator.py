@@ -0,0 +1,282 @@
+import os
+
+import numpy as np
+
+from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY
+
+from .reader import AerogenReader
+from .geometry import transform_array
+from . import crs_registry
+
+# maximal number of (point, edge) pairs evaluated at once
+DISTANCE_CHUNK_SIZE = 2 ** 20
+
+def segment_distance(points, a, b):
+    """Returns distance of each point to the nearest segment.
+
+    :param points: (n, 2) array of points
+    :param a: (m, 2) array of segment start points
+    :param b: (m, 2) array of segment end points
+    """
+    ab = b - a
+    length2 = (ab ** 2).sum(axis=1)
+    length2[length2 == 0] = np.nan
+    distance = np.empty(len(points))
+    step = max(1, DISTANCE_CHUNK_SIZE // max(1, len(a)))
+    for start in range(0, len(points), step):
+        p = points[start:start + step, np.newaxis, :]
+        t = np.clip(((p - a) * ab).sum(axis=2) / length2, 0, 1)
+        # degenerated segments
+        t = np.nan_to_num(t)
+        nearest = a + t[..., np.newaxis] * ab
+        distance[start:start + step] = np.hypot(*(p - nearest).transpose(2, 0, 1)).min(axis=1)
+
+    return distance
+
+def parse_lines(lines):
+    """Parse vendor line file (_sl.xyz, _tl.xyz).
+
+    Returns tuple of line ids, UTM endpoints (n, 2, 2), WGS84 endpoints
+    (n, 2, 2) and number of lines declared in the header.
+    """
+    ids = []
+    rows = []
+    count = None
+    for line in lines:
+        items = line.split()
+        if not items:
+            continue
+        if items[0] == '/':
+            if 'Number of' in line:
+                count = int(line.rsplit(':', 1)[1])
+            continue
+        if items[0] == 'Line':
+            ids.append(items[1])
+            continue
+        if len(items) >= 5 and ids and (items[0][0].isdigit() or items[0][0] == '-'):
+            rows.append([len(ids) - 1, int(items[4])] + [float(v) for v in items[:4]])
+
+    return _line_arrays(ids, rows, (2, 3), (4, 5)) + (count, )
+
+def parse_latlon(lines):
+    """Parse vendor line file with WGS84 coordinates (_sl_LatLon.xyz, _tl_LatLon.xyz).
+
+    Returns tuple of line ids, WGS84 endpoints (n, 2, 2) and number of
+    lines declared in the header.
+    """
+    ids = []
+    rows = []
+    count = None
+    for line in lines:
+        items = line.split()
+        if not items or items[0] == 'Line':
+            continue
+        if items[0] == '/':
+            if 'Number of' in line:
+                count = int(line.rsplit(':', 1)[1])
+            continue
+        if len(items) == 4:
+            ids.append(items.pop(0))
+        if len(items) == 3 and ids:
+            rows.append([len(ids) - 1, int(items[2]), float(items[0]), float(items[1])])
+
+    ids, lonlat = _line_arrays(ids, rows, (2, 3))
+    return ids, lonlat, count
+
+def parse_crossings(lines):
+    """Parse vendor crossings file (_crs.xyz).
+
+    Returns tuple of tie line ids, survey line ids and (n, 2) array of
+    crossing points.
+    """
+    tie_ids = []
+    survey_ids = []
+    points = []
+    tie_id = None
+    for line in lines:
+        items = line.split()
+        if not items or items[0] == '/':
+            continue
+        if items[0].startswith('TL') and len(items) == 1:
+            tie_id = items[0][2:]
+        elif items[0].startswith('SL') and len(items) == 3 and tie_id:
+            tie_ids.append(tie_id)
+            survey_ids.append(items[0][2:])
+            points.append((float(items[1]), float(items[2])))
+
+    return np.array(tie_ids), np.array(survey_ids), np.array(points, dtype=float).reshape(-1, 2)
+
+def _line_arrays(ids, rows, *columns):
+    """Group parsed rows into (n, 2, 2) arrays by line and point id."""
+    rows = np.array(rows, dtype=float).reshape(-1, 2 + 2 * len(columns))
+    # keep lines with both endpoints defined
+    counts = np.bincount(rows[:, 0].astype(int), minlength=len(ids))
+    valid = counts == 2
+    rows = rows[valid[rows[:, 0].astype(int)]]
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    arrays = [rows[:, list(c)].reshape(-1, 2, 2) for c in columns]
+
+    return (np.array(ids)[valid], ) + tuple(arrays)
+
+class AerogenValidator(object):
+    # suffixes of survey delivery files
+    FILES = ('', '_sl', '_sl_LatLon', '_tl', '_tl_LatLon', '_crs')
+
+    def __init__(self, filename, opener=None, tolerance=5.0,
+                 angle_tolerance=1e-5, spacing_tolerance=0.01):
+        """Cross-file consistency checker of a survey delivery.
+
+        :param filename: main XYZ file
+        :param opener: function used to open input files
+        :param tolerance: position tolerance in meters
+        :param angle_tolerance: WGS84 coordinates tolerance in degrees
+        :param spacing_tolerance: line spacing tolerance relative to spacing
+        """
+        self._filename = filename
+        self._open = opener or open
+        self._tolerance = tolerance
+        self._angle_tolerance = angle_tolerance
+        self._spacing_tolerance = spacing_tolerance
+
+        self._reader = AerogenReader(filename, opener)
+        self._crs = crs_registry.crs(self._reader.crs())
+        self._report = []
+
+    def crs(self):
+        return self._crs
+
+    def report(self):
+        return self._report
+
+    def validate(self):
+        """Run all checks.
+
+        Returns list of issues as tuples (check, line id, message, x, y),
+        x and y are in UTM or None if the issue has no location.
+        """
+        self._report = []
+        polygon = self._reader.polygon()
+        lines = {}
+        for type in ('sl', 'tl'):
+            content = self._read('_' + type)
+            if content is None:
+                continue
+            ids, xy, lonlat, count = parse_lines(content)
+            lines[type] = (ids, xy)
+
+            self._check_count(type, count, len(ids))
+            self._check_projection(type, ids, xy, lonlat)
+            self._check_latlon(type, ids, lonlat)
+            self._check_spacing(type, ids, xy, self._reader.spacing(type))
+            self._check_polygon(type, ids, xy, polygon)
+
+        content = self._read('_crs')
+        if content is not None and len(lines) == 2:
+            self._check_crossings(parse_crossings(content), lines['sl'], lines['tl'])
+
+        return self._report
+
+    def errors_layer(self, name='validation_errors'):
+        """Returns memory layer with located issues."""
+        layer = QgsVectorLayer(
+            'Point?crs={}&field=check:string&field=line:string&field=message:string'.format(
+                self._crs.authid()), name, 'memory'
+        )
+        features = []
+        for check, line_id, message, x, y in self._report:
+            if x is None:
+                continue
+            feature = QgsFeature(layer.fields())
+            feature.setAttributes([check, line_id, message])
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            features.append(feature)
+        layer.dataProvider().addFeatures(features)
+        layer.updateExtents()
+
+        return layer
+
+    def _read(self, suffix):
+        dirname = os.path.dirname(self._filename)
+        basename = os.path.splitext(os.path.basename(self._filename))[0]
+        path = os.path.join(dirname, basename + suffix + '.xyz')
+        try:
+            with self._open(path) as f:
+                return f.readlines()
+        except IOError:
+            self._add('missing', None, 'File {} not found'.format(os.path.basename(path)))
+            return None
+
+    def _add(self, check, line_id, message, x=None, y=None):
+        self._report.append((check, line_id, message, x, y))
+
+    def _add_points(self, check, ids, points, mask, message):
+        for line_id, point in zip(ids[mask], points[mask]):
+            self._add(check, str(line_id), message, float(point[0]), float(point[1]))
+
+    def _check_count(self, type, count, parsed):
+        if count is not None and count != parsed:
+            self._add('count', None, '{}: header declares {} lines, {} found'.format(
+                type, count, parsed))
+
+    def _check_projection(self, type, ids, xy, lonlat):
+        """UTM and WGS84 coordinates of line endpoints must agree."""
+        xform = crs_registry.transform(4326, self._crs)
+        projected = transform_array(lonlat.reshape(-1, 2), xform)
+        points = xy.reshape(-1, 2)
+        distance = np.hypot(*(projected - points).T)
+        self._add_points('projection', np.repeat(ids, 2), points, distance > self._tolerance,
+                         '{}: UTM and WGS84 coordinates differ'.format(type))
+
+    def _check_latlon(self, type, ids, lonlat):
+        """WGS84 coordinates must agree with _LatLon file."""
+        content = self._read('_{}_LatLon'.format(type))
+        if content is None:
+            return
+        ll_ids, ll_lonlat, count = parse_latlon(content)
+        self._check_count('{}_LatLon'.format(type), count, len(ll_ids))
+
+        common, i, j = np.intersect1d(ids, ll_ids, return_indices=True)
+        for line_id in np.setxor1d(ids, ll_ids):
+            self._add('latlon', str(line_id), '{}: line missing in one of files'.format(type))
+        diff = np.abs(lonlat[i] - ll_lonlat[j]).reshape(len(common), -1).max(axis=1)
+        for line_id in common[diff > self._angle_tolerance]:
+            self._add('latlon', str(line_id), '{}: coordinates differ from LatLon file'.format(type))
+
+    def _check_spacing(self, type, ids, xy, spacing):
+        """Distance of neighbouring lines must match header spacing."""
+        if not spacing or len(xy) < 2:
+            return
+        direction = xy[0, 1] - xy[0, 0]
+        direction /= np.hypot(*direction)
+        middle = xy.mean(axis=1)
+        delta = np.diff(middle, axis=0)
+        distance = np.abs(delta[:, 0] * direction[1] - delta[:, 1] * direction[0])
+        mask = np.abs(distance - spacing) > spacing * self._spacing_tolerance
+        self._add_points('spacing', ids[1:], middle[1:], mask,
+                         '{}: spacing differs from {}'.format(type, spacing))
+
+    def _check_polygon(self, type, ids, xy, polygon):
+        """Line endpoints must lie on area polygon."""
+        if len(polygon) < 3:
+            return
+        ring = np.vstack((polygon, polygon[:1]))
+        points = xy.reshape(-1, 2)
+        distance = segment_distance(points, ring[:-1], ring[1:])
+        self._add_points('polygon', np.repeat(ids, 2), points, distance > self._tolerance,
+                         '{}: endpoint does not lie on area polygon'.format(type))
+
+    def _check_crossings(self, crossings, sl, tl):
+        """Crossing points must lie on both survey and tie line."""
+        tie_ids, survey_ids, points = crossings
+        for ids, lines, crossing_ids in ((sl[0], sl[1], survey_ids), (tl[0], tl[1], tie_ids)):
+            index = {line_id: i for i, line_id in enumerate(ids)}
+            found = np.array([line_id in index for line_id in crossing_ids], dtype=bool)
+            for line_id in crossing_ids[~found]:
+                self._add('crossing', str(line_id), 'Crossing refers to unknown line')
+            idx = np.array([index[line_id] for line_id in crossing_ids[found]], dtype=int)
+            segments = lines[idx]
+            ab = segments[:, 1] - segments[:, 0]
+            t = np.clip(((points[found] - segments[:, 0]) * ab).sum(axis=1) / (ab ** 2).sum(axis=1), 0, 1)
+            distance = np.hypot(*(points[found] - segments[:, 0] - t[:, np.newaxis] * ab).T)
+            self._add_points('crossing', crossing_ids[found], points[found], distance > self._tolerance,
+                             'Crossing point does not lie on line')
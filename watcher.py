@@ -0,0 +1,84 @@
+import os
+
+from qgis.PyQt.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+
+class AerogenWatcher(QObject):
+    # emitted with set of changed products ('area', 'sl', 'tl')
+    changed = pyqtSignal(set)
+
+    def __init__(self, filename, delay=500, parent=None):
+        """Watch survey input files.
+
+        Changes are debounced, products are reported only when no other
+        change came within delay.
+
+        :param filename: main XYZ file
+        :param delay: debounce delay in milliseconds
+        """
+        super(AerogenWatcher, self).__init__(parent)
+
+        dirname = os.path.dirname(filename)
+        basename = os.path.splitext(os.path.basename(filename))[0]
+        self._files = {
+            os.path.normpath(filename): 'area',
+            os.path.normpath(os.path.join(dirname, basename + '_sl.xyz')): 'sl',
+            os.path.normpath(os.path.join(dirname, basename + '_tl.xyz')): 'tl',
+        }
+        self._mtimes = {}
+        self._pending = set()
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(delay)
+        self._timer.timeout.connect(self._emit)
+
+        self._watcher = QFileSystemWatcher(self)
+        # directory is watched too since files replaced by a new copy
+        # are dropped from the watcher
+        self._watcher.addPath(dirname)
+        self._watcher.fileChanged.connect(self._fileChanged)
+        self._watcher.directoryChanged.connect(self._directoryChanged)
+        self._addFiles()
+
+    def stop(self):
+        self._timer.stop()
+        paths = self._watcher.files() + self._watcher.directories()
+        if paths:
+            self._watcher.removePaths(paths)
+
+    def changedFiles(self, products):
+        """Returns input files of given products."""
+        return [path for path, product in self._files.items() if product in products]
+
+    def _addFiles(self):
+        watched = self._watcher.files()
+        for path in self._files:
+            if os.path.exists(path):
+                self._mtimes.setdefault(path, os.path.getmtime(path))
+                if path not in watched:
+                    self._watcher.addPath(path)
+
+    def _fileChanged(self, path):
+        path = os.path.normpath(path)
+        if path in self._files and os.path.exists(path):
+            self._mtimes[path] = os.path.getmtime(path)
+            self._pending.add(self._files[path])
+            self._timer.start()
+        self._addFiles()
+
+    def _directoryChanged(self, path):
+        for path in self._files:
+            if not os.path.exists(path):
+                continue
+            mtime = os.path.getmtime(path)
+            if self._mtimes.get(path) != mtime:
+                self._mtimes[path] = mtime
+                self._pending.add(self._files[path])
+                self._timer.start()
+        self._addFiles()
+
+    def _emit(self):
+        products = self._pending
+        self._pending = set()
+        if products:
+            self.changed.emit(products)
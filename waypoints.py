@@ -0,0 +1,260 @@
+import math
+
+import numpy as np
+
+from .geometry import transform_array
+from .exceptions import AerogenError
+
+# number of waypoints generated and written at once
+CHUNK_SIZE = 1000000
+
+# piece kinds
+LINE = 0
+TURN = 1
+KIND_NAMES = (b'line', b'turn')
+
+def _left(d):
+    """Rotate (n, 2) direction vectors by 90 degrees counter-clockwise."""
+    return np.column_stack((-d[:, 1], d[:, 0]))
+
+def _sweep(center, start, end, sign):
+    """Returns start angles and signed sweeps of arcs turning in sign direction."""
+    a0 = np.arctan2(start[:, 1] - center[:, 1], start[:, 0] - center[:, 0])
+    a1 = np.arctan2(end[:, 1] - center[:, 1], end[:, 0] - center[:, 0])
+    return a0, sign * np.mod(sign * (a1 - a0), 2 * math.pi)
+
+def format_fixed(values, decimals):
+    """Format numbers as right aligned ASCII matrix without Python objects.
+
+    :param values: (n, ) array of numbers
+    :param decimals: number of decimal places
+
+    :return: (n, width) uint8 array, leading unused bytes are zero
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = np.round(np.abs(values) * 10 ** decimals).astype(np.int64)
+    negative = (values < 0) & (scaled > 0)
+    # at least one integer digit
+    digits = np.maximum(np.floor(np.log10(np.maximum(scaled, 1))).astype(int) + 1, decimals + 1)
+    point = 1 if decimals else 0
+    width = int(digits.max(initial=1)) + point + 1
+
+    result = np.zeros((len(values), width), dtype=np.uint8)
+    rest = scaled.copy()
+    digit = 0
+    for k in range(width):
+        column = width - 1 - k
+        if point and k == decimals:
+            result[:, column] = ord('.')
+            continue
+        used = digit < digits
+        result[:, column] = np.where(used, ord('0') + rest % 10, 0)
+        rest //= 10
+        digit += 1
+    # sign in front of the first digit
+    sign = width - 1 - (digits + point)
+    rows = np.nonzero(negative)[0]
+    result[rows, sign[rows]] = ord('-')
+
+    return result
+
+def compose(parts, count):
+    """Join matrices and byte literals into rows and drop padding.
+
+    :param parts: list of (count, w) uint8 matrices or bytes literals
+    :param count: number of rows
+
+    :return: bytes of all rows
+    """
+    columns = []
+    for part in parts:
+        if isinstance(part, bytes):
+            part = np.broadcast_to(np.frombuffer(part, dtype=np.uint8), (count, len(part)))
+        columns.append(part)
+    matrix = np.hstack(columns)
+    return matrix[matrix != 0].tobytes()
+
+class AerogenWaypoints(object):
+    def __init__(self, xy, ids, spacing, radius=0.0):
+        """Along-track densification of flight path.
+
+        Waypoints are placed every spacing meters along each line and
+        connection, line endpoints are always included. Connections
+        are replaced by turn arcs of given radius tangent to both lines
+        and joined by a straight segment.
+
+        :param xy: corrected flight path as (n, 2) array in UTM, line k
+        is defined by points 2k and 2k+1 (see AerogenReader.line_array)
+        :param ids: line numbers, AerogenError is raised when their
+        number does not match number of lines
+        :param spacing: along-track spacing in meters
+        :param radius: turn radius in meters, 0 for straight connections
+        """
+        if not spacing or spacing <= 0:
+            raise AerogenError("Waypoint spacing must be positive")
+
+        count = len(xy) // 2
+        self._xy = np.asarray(xy[:2 * count], dtype=float)
+        self._spacing = float(spacing)
+        self._radius = float(radius or 0)
+        if ids is not None and len(ids) != count:
+            raise AerogenError("Number of line numbers ({}) does not match number of lines ({})".format(
+                len(ids), count))
+        try:
+            self._ids = np.asarray(ids).astype(np.int64)
+        except (TypeError, ValueError):
+            # no or not numeric line numbers
+            self._ids = np.arange(count, dtype=np.int64)
+        self._pieces()
+
+    def _pieces(self):
+        """Build path pieces as arrays.
+
+        Straight piece is given by origin, direction and length, arc by
+        center, radius, start angle and signed sweep.
+        """
+        start = self._xy[0::2]
+        end = self._xy[1::2]
+        count = len(start)
+        length = np.hypot(*(end - start).T)
+        direction = (end - start) / np.where(length > 0, length, 1)[:, np.newaxis]
+
+        # each line is followed by connection of 3 pieces (arc, straight, arc)
+        size = 4 * count - 3 if count else 0
+        self._kind = np.full(size, TURN)
+        self._line = np.repeat(np.arange(count), 4)[:size]
+        self._origin = np.zeros((size, 2))
+        self._dir = np.zeros((size, 2))
+        self._arc_radius = np.zeros(size)
+        self._angle = np.zeros(size)
+        self._sweep = np.zeros(size)
+        self._length = np.zeros(size)
+
+        lines = np.arange(0, size, 4)
+        self._kind[lines] = LINE
+        self._origin[lines] = start
+        self._dir[lines] = direction
+        self._length[lines] = length
+        if count < 2:
+            self._finish()
+            return
+
+        e, s = end[:-1], start[1:]
+        d1, d2 = direction[:-1], direction[1:]
+        straight = np.arange(2, size, 4)
+        if self._radius <= 0:
+            chord = s - e
+            chord_length = np.hypot(*chord.T)
+            self._origin[straight] = e
+            self._dir[straight] = chord / np.where(chord_length > 0, chord_length, 1)[:, np.newaxis]
+            self._length[straight] = chord_length
+            self._finish()
+            return
+
+        r = self._radius
+        # turn towards the next line
+        cross = d1[:, 0] * (s - e)[:, 1] - d1[:, 1] * (s - e)[:, 0]
+        sign = np.where(cross >= 0, 1.0, -1.0)
+        c1 = e + r * sign[:, np.newaxis] * _left(d1)
+        c2 = s + r * sign[:, np.newaxis] * _left(d2)
+        between = c2 - c1
+        distance = np.hypot(*between.T)
+        # concentric arcs, single arc ends in the next line heading
+        u = np.where((distance > 1e-9)[:, np.newaxis],
+                     between / np.where(distance > 0, distance, 1)[:, np.newaxis], d2)
+        t1 = c1 - r * sign[:, np.newaxis] * _left(u)
+        t2 = c2 - r * sign[:, np.newaxis] * _left(u)
+
+        for index, center, a, b in ((straight - 1, c1, e, t1), (straight + 1, c2, t2, s)):
+            angle, sweep = _sweep(center, a, b, sign)
+            self._origin[index] = center
+            self._arc_radius[index] = r
+            self._angle[index] = angle
+            self._sweep[index] = sweep
+            self._length[index] = r * np.abs(sweep)
+        self._origin[straight] = t1
+        self._dir[straight] = u
+        self._length[straight] = distance
+
+        self._finish()
+
+    def _finish(self):
+        # number of waypoints of each piece, piece start is the previous piece end
+        self._counts = np.where(self._length > 0, np.ceil(self._length / self._spacing), 0).astype(np.int64)
+        self._cumulative = np.cumsum(self._counts)
+        self._chainage = np.cumsum(self._length) - self._length
+
+    def count(self):
+        """Returns total number of waypoints."""
+        return int(self._cumulative[-1]) + 1 if len(self._counts) else 0
+
+    def length(self):
+        """Returns total path length in meters."""
+        return float(self._length.sum())
+
+    def points(self, start, stop):
+        """Returns waypoints in range of indices.
+
+        :return: tuple of (n, 2) array of coordinates, line numbers,
+        piece kinds and along-track distances
+        """
+        index = np.arange(start, min(stop, self.count()))
+        # first waypoint is start of the first piece
+        g = np.maximum(index - 1, 0)
+        piece = np.searchsorted(self._cumulative, g, side='right')
+        j = g - (self._cumulative[piece] - self._counts[piece]) + 1
+        s = np.minimum(j * self._spacing, self._length[piece])
+        s[index == 0] = 0
+
+        arc = self._arc_radius[piece] > 0
+        xy = self._origin[piece] + s[:, np.newaxis] * self._dir[piece]
+        if arc.any():
+            pa = piece[arc]
+            r = self._arc_radius[pa]
+            angle = self._angle[pa] + np.sign(self._sweep[pa]) * s[arc] / r
+            xy[arc] = self._origin[pa] + r[:, np.newaxis] * np.column_stack((np.cos(angle), np.sin(angle)))
+
+        return xy, self._ids[self._line[piece]], self._kind[piece], self._chainage[piece] + s
+
+    def chunks(self, chunk_size=CHUNK_SIZE):
+        """Yield waypoints in chunks, see points()."""
+        for start in range(0, self.count(), chunk_size):
+            yield self.points(start, start + chunk_size)
+
+    def write_csv(self, filename, xform=None, chunk_size=CHUNK_SIZE):
+        """Write waypoints into CSV file.
+
+        :param xform: optional QgsCoordinateTransform into WGS84, adds
+        lon and lat columns
+        """
+        kinds = np.zeros((2, 4), dtype=np.uint8)
+        for i, name in enumerate(KIND_NAMES):
+            kinds[i, :len(name)] = np.frombuffer(name, dtype=np.uint8)
+
+        with open(filename, 'wb') as f:
+            f.write(b'line,kind,distance,x,y' + (b',lon,lat' if xform else b'') + b'\n')
+            for xy, line, kind, distance in self.chunks(chunk_size):
+                n = len(xy)
+                parts = [format_fixed(line, 0), b',', kinds[kind], b',',
+                         format_fixed(distance, 2), b',',
+                         format_fixed(xy[:, 0], 2), b',', format_fixed(xy[:, 1], 2)]
+                if xform:
+                    lonlat = transform_array(xy, xform)
+                    parts += [b',', format_fixed(lonlat[:, 0], 8), b',', format_fixed(lonlat[:, 1], 8)]
+                f.write(compose(parts + [b'\n'], n))
+
+    def write_gpx(self, filename, xform, name='', chunk_size=CHUNK_SIZE):
+        """Write waypoints into GPX file as route.
+
+        :param xform: QgsCoordinateTransform into WGS84
+        :param name: route name
+        """
+        with open(filename, 'wb') as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                    b'<gpx version="1.1" creator="AeroGen" xmlns="http://www.topografix.com/GPX/1/1">\n')
+            f.write('<rte><name>{}</name>\n'.format(name).encode('utf-8'))
+            for xy, line, kind, distance in self.chunks(chunk_size):
+                lonlat = transform_array(xy, xform)
+                f.write(compose([b'<rtept lat="', format_fixed(lonlat[:, 1], 8),
+                                 b'" lon="', format_fixed(lonlat[:, 0], 8), b'"/>\n'], len(xy)))
+            f.write(b'</rte>\n</gpx>\n')